@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Product, ProductImage, Collection, Order, OrderItem, Category
+from .models import Product, ProductImage, Collection, Order, OrderItem, Category, ArchivedOrder
 
+from . import inventory, lifecycle, rollups
 from .emails import send_order_confirmation_email
 
 @admin.register(Category)
@@ -14,11 +15,35 @@ class ProductImageInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'featured', 'bestseller')
+    list_display = ('name', 'category', 'price', 'stock', 'featured', 'bestseller')
     list_filter = ('category', 'featured', 'bestseller')
     search_fields = ('name', 'description')
     inlines = [ProductImageInline]
 
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        # post back the stock the page showed, to tell what the admin changed
+        form.base_fields['stock'].show_hidden_initial = True
+        return form
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'stock' in form.changed_data:
+            # Product.save() leaves stock alone; apply the edit as the change
+            # the admin made to what they saw, on top of any reservations
+            # made since the page was loaded.
+            field = form.fields['stock']
+            before = field.to_python(form.data.get(form.add_initial_prefix('stock')))
+            after = form.cleaned_data['stock']
+            if after is None:
+                Product.objects.filter(pk=obj.pk).update(stock=None)
+            else:
+                try:
+                    inventory.adjust(obj.pk, after - (before or 0))
+                except inventory.OutOfStock:
+                    # fewer left than they took away: the shelf is empty
+                    Product.objects.filter(pk=obj.pk).update(stock=0)
+
 @admin.register(Collection)
 class CollectionAdmin(admin.ModelAdmin):
     list_display = ('name',)
@@ -31,10 +56,10 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'first_name', 'last_name', 'email', 'status', 'created_at', 'total')
+    list_display = ('id', 'first_name', 'last_name', 'email', 'status', 'paid_at', 'created_at', 'total')
     list_filter = ('status', 'created_at')
     search_fields = ('id', 'first_name', 'last_name', 'email')
-    readonly_fields = ('created_at',)
+    readonly_fields = ('paid_at', 'created_at')
     inlines = [OrderItemInline]
 
     def save_model(self, request, obj, form, change):
@@ -44,3 +69,25 @@ class OrderAdmin(admin.ModelAdmin):
             if old_obj.status != 'paid' and obj.status == 'paid':
                 send_order_confirmation_email(obj)
         super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if not change:
+            # Status changes are followed by a signal, new orders are not
+            rollups.record_order(form.instance)
+
+    def delete_model(self, request, obj):
+        lifecycle.delete_orders(Order.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        lifecycle.delete_orders(queryset)
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'email', 'status', 'created_at', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('=id', 'email')
+    readonly_fields = ('id', 'email', 'status', 'created_at', 'archived_at', 'data')
+
+    def has_add_permission(self, request):
+        return False
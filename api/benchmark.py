@@ -0,0 +1,437 @@
+"""
+Synthetic data generation and an in-process load driver for the
+`seed_bench_data` and `bench` management commands.
+
+Requests go through the full Django stack (middleware, DRF, serializers,
+ORM) using the test client, one client and DB connection per thread, with
+Stripe and SMTP replaced by in-memory fakes. Network latency to the app is
+not part of the numbers; queries per request and server time are.
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from . import snapshots
+from .models import Category, Collection, Order, OrderItem, Product, ProductImage
+from .serializers import ProductSerializer
+
+BENCH_WEBHOOK_SECRET = 'whsec_bench'
+BENCH_ADMIN_USERNAME = 'bench-admin'
+
+CURRENCIES = ['USD', 'USD', 'USD', 'GBP', 'AED', 'AUD']
+STATUSES = ['pending', 'paid', 'paid', 'shipped', 'delivered', 'delivered', 'cancelled']
+
+
+# =========================
+# DATA GENERATOR
+# =========================
+
+@contextmanager
+def explicit_created_at(model):
+    """Let bulk_create keep the created_at values we generate."""
+    field = model._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def _batches(total, batch_size):
+    done = 0
+    while done < total:
+        size = min(batch_size, total - done)
+        yield size
+        done += size
+
+
+def seed(products=100_000, images_per_product=3, orders=1_000_000, max_items=4,
+         categories=20, collections=10, batch_size=5000, days=730, random_seed=42, log=print):
+    rng = random.Random(random_seed)
+    now = timezone.now()
+
+    category_objs = Category.objects.bulk_create(
+        [Category(name=f'Bench Category {i}', description='Benchmark data') for i in range(categories)],
+        ignore_conflicts=True,
+    )
+    category_ids = list(Category.objects.filter(name__startswith='Bench Category ').values_list('id', flat=True))
+    log(f'{len(category_objs)} categories')
+
+    created = 0
+    for size in _batches(products, batch_size):
+        with explicit_created_at(Product):
+            batch = Product.objects.bulk_create([
+                Product(
+                    name=f'Bench Product {created + i}',
+                    category_id=rng.choice(category_ids),
+                    price=Decimal(rng.randrange(500, 20000)) / 100,
+                    description='Benchmark product description. ' * 8,
+                    details='Benchmark product details.',
+                    image=f'products/images/bench-{(created + i) % 500}.jpg',
+                    delivery_charges=Decimal(rng.choice([0, 0, 499, 999])) / 100,
+                    featured=rng.random() < 0.05,
+                    bestseller=rng.random() < 0.05,
+                    created_at=now - timedelta(days=rng.randrange(days)),
+                )
+                for i in range(size)
+            ])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'products/images/bench-gallery-{product.pk % 500}-{n}.jpg')
+            for product in batch
+            for n in range(images_per_product)
+        ])
+        # bulk_create skips the signals that keep snapshots current
+        snapshots.refresh([product.pk for product in batch])
+        created += size
+        log(f'{created}/{products} products')
+
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    prices = dict(Product.objects.values_list('id', 'price'))
+
+    collection_objs = Collection.objects.bulk_create([
+        Collection(name=f'Bench Collection {i}', description='Benchmark data', image='collections/bench.jpg')
+        for i in range(collections)
+    ])
+    Through = Collection.products.through
+    Through.objects.bulk_create([
+        Through(collection_id=collection.pk, product_id=product_id)
+        for collection in collection_objs
+        for product_id in rng.sample(product_ids, min(50, len(product_ids)))
+    ])
+    log(f'{len(collection_objs)} collections')
+
+    created = 0
+    for size in _batches(orders, batch_size):
+        order_objs = []
+        order_lines = []
+        for i in range(size):
+            lines = [
+                (product_id, rng.randint(1, 3))
+                for product_id in rng.sample(product_ids, min(rng.randint(1, max_items), len(product_ids)))
+            ]
+            shipping = Decimal(rng.choice([0, 499, 999])) / 100
+            total = sum(prices[product_id] * quantity for product_id, quantity in lines) + shipping
+            order_objs.append(Order(
+                first_name='Bench', last_name=f'Customer {created + i}',
+                email=f'bench{created + i}@example.com', address='1 Bench Street',
+                city='London', country='GB', postal_code='E1 1AA', phone='000',
+                currency=rng.choice(CURRENCIES), total=total, shipping=shipping,
+                status=rng.choice(STATUSES),
+                created_at=now - timedelta(days=rng.randrange(days), seconds=rng.randrange(86400)),
+            ))
+            order_lines.append(lines)
+
+        with explicit_created_at(Order):
+            order_objs = Order.objects.bulk_create(order_objs)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order_id=order.pk, product_id=product_id, name=f'Bench Product {product_id}',
+                price=prices[product_id], quantity=quantity,
+            )
+            for order, lines in zip(order_objs, order_lines)
+            for product_id, quantity in lines
+        ])
+        created += size
+        log(f'{created}/{orders} orders')
+
+
+# =========================
+# FAKES
+# =========================
+
+class FakeCheckoutSession:
+    _counter = 0
+    _lock = threading.Lock()
+
+    def __init__(self, **kwargs):
+        with self._lock:
+            FakeCheckoutSession._counter += 1
+            number = FakeCheckoutSession._counter
+        self.id = f'cs_bench_{number}'
+        self.url = f'https://checkout.stripe.test/{self.id}'
+        self.metadata = kwargs.get('metadata', {})
+
+    @classmethod
+    def create(cls, **kwargs):
+        return cls(**kwargs)
+
+
+@contextmanager
+def fake_externals():
+    """Replace Stripe and SMTP with in-memory fakes for the whole run."""
+    with mock.patch('stripe.checkout.Session.create', side_effect=FakeCheckoutSession.create), \
+            override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                STRIPE_WEBHOOK_SECRET=BENCH_WEBHOOK_SECRET,
+            ):
+        yield
+
+
+def sign_webhook(payload, secret=BENCH_WEBHOOK_SECRET):
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+# =========================
+# SCENARIOS
+# =========================
+
+class Scenario(ABC):
+    """
+    Builds one request for a client. `admin` scenarios run with a logged-in
+    staff client.
+    """
+    admin = False
+
+    def __init__(self):
+        self.product_ids = list(Product.objects.order_by('?').values_list('id', flat=True)[:1000])
+        self.order_ids = list(Order.objects.order_by('?').values_list('id', flat=True)[:1000])
+
+    @abstractmethod
+    def request(self, client, rng):
+        """Send one request with `client` and return the response."""
+
+
+class CatalogScenario(Scenario):
+    def request(self, client, rng):
+        path = rng.choice(['/api/products/', '/api/categories/', '/api/collections/'])
+        return client.get(path)
+
+
+class ProductDetailScenario(Scenario):
+    def request(self, client, rng):
+        return client.get(f'/api/products/{rng.choice(self.product_ids)}/')
+
+
+class CheckoutScenario(Scenario):
+    def request(self, client, rng):
+        items = [
+            {'product': {'id': product_id}, 'quantity': rng.randint(1, 3), 'unit_price': '19.99'}
+            for product_id in rng.sample(self.product_ids, min(3, len(self.product_ids)))
+        ]
+        payload = {
+            'items': items, 'email': 'bench@example.com', 'firstName': 'Bench', 'lastName': 'Runner',
+            'address': '1 Bench Street', 'city': 'London', 'country': 'GB', 'postalCode': 'E1 1AA',
+            'phone': '000', 'currency': rng.choice(['USD', 'GBP']), 'shipping_cost': '4.99',
+        }
+        return client.post(
+            '/api/payments/create-checkout-session/', data=json.dumps(payload), content_type='application/json'
+        )
+
+
+class WebhookScenario(Scenario):
+    def request(self, client, rng):
+        order_id = rng.choice(self.order_ids)
+        payload = json.dumps({
+            'id': f'evt_bench_{order_id}',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {
+                'id': f'cs_bench_{order_id}', 'object': 'checkout.session',
+                'metadata': {'order_id': str(order_id)},
+            }},
+        })
+        return client.post(
+            '/api/payments/webhook/', data=payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_webhook(payload),
+        )
+
+
+class ExportScenario(Scenario):
+    admin = True
+
+    def request(self, client, rng):
+        return client.get('/api/orders/')
+
+
+class AccountScenario(Scenario):
+    # Little besides authentication, so queries_per_request shows what the
+    # session store costs; compare runs with SESSION_STORE=db and cached_db.
+    admin = True
+
+    def request(self, client, rng):
+        return client.get('/api/me/')
+
+
+class ReceiptScenario(Scenario):
+    def request(self, client, rng):
+        return client.get(f'/api/payments/generate-receipt/{rng.choice(self.order_ids)}/')
+
+
+SCENARIOS = {
+    'catalog': CatalogScenario,
+    'product': ProductDetailScenario,
+    'checkout': CheckoutScenario,
+    'webhook': WebhookScenario,
+    'export': ExportScenario,
+    'receipt': ReceiptScenario,
+    'account': AccountScenario,
+}
+
+
+# =========================
+# RUNNER
+# =========================
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def bench_admin():
+    user, _ = User.objects.get_or_create(
+        username=BENCH_ADMIN_USERNAME, defaults={'is_staff': True, 'is_superuser': True}
+    )
+    return user
+
+
+def _worker(scenario, requests, random_seed):
+    rng = random.Random(random_seed)
+    client = Client()
+    if scenario.admin:
+        client.force_login(bench_admin())
+
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    samples = []
+    errors = 0
+    try:
+        with connection.execute_wrapper(count):
+            for _ in range(requests):
+                queries[0] = 0
+                started = time.perf_counter()
+                try:
+                    response = scenario.request(client, rng)
+                    ok = response.status_code < 400
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - started
+                if ok:
+                    samples.append((elapsed, queries[0]))
+                else:
+                    errors += 1
+    finally:
+        connection.close()
+    return samples, errors
+
+
+def run_scenario(name, concurrency, requests):
+    scenario = SCENARIOS[name]()
+    per_worker = max(1, requests // concurrency)
+    # psycopg_pool with DB_POOL on PostgreSQL; its counters restart per run
+    db_pool = getattr(connection, 'pool', None)
+    if db_pool is not None:
+        db_pool.pop_stats()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda n: _worker(scenario, per_worker, n), range(concurrency)))
+    wall = time.perf_counter() - started
+
+    samples = [sample for worker_samples, _ in results for sample in worker_samples]
+    errors = sum(worker_errors for _, worker_errors in results)
+    latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+    query_counts = [count for _, count in samples]
+
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    result = {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': len(samples) + errors,
+        'errors': errors,
+        'duration_s': round(wall, 3),
+        'throughput_rps': round(len(samples) / wall, 2) if wall else None,
+        'p50_ms': rounded(percentile(latencies, 50)),
+        'p95_ms': rounded(percentile(latencies, 95)),
+        'p99_ms': rounded(percentile(latencies, 99)),
+        'queries_per_request': rounded(sum(query_counts) / len(query_counts)) if query_counts else None,
+    }
+    if db_pool is not None:
+        # connections opened, time spent waiting for one, and timeouts
+        result['db_pool'] = db_pool.pop_stats()
+    return result
+
+
+def dataset_summary():
+    return {
+        'products': Product.objects.count(),
+        'product_images': ProductImage.objects.count(),
+        'orders': Order.objects.count(),
+        'order_items': OrderItem.objects.count(),
+        'database': connection.vendor,
+        'session_store': settings.SESSION_STORE,
+        'db_pool': connection.settings_dict.get('OPTIONS', {}).get('pool', {}).get('max_size'),
+    }
+
+
+def compare(current, previous):
+    """Yield (key, metric, old, new) for every result present in both runs."""
+    old = {(r['scenario'], r['concurrency']): r for r in previous['results']}
+    for result in current['results']:
+        key = (result['scenario'], result['concurrency'])
+        if key not in old:
+            continue
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+            yield key, metric, old[key].get(metric), result.get(metric)
+
+
+# =========================
+# MEDIA URLS
+# =========================
+
+def media_url_benchmark(page_size=500, rounds=5):
+    """
+    Time serializing a page of products (with their galleries) against S3
+    media storage, with presigned boto3 URLs and with public MEDIA_URL
+    URLs. Presigning is local, so no bucket or network is needed. Returns
+    the best of `rounds` in ms for each mode.
+    """
+    # imported here: django-storages is only needed with Supabase storage
+    from core.storage import MediaStorage
+
+    storage = MediaStorage(
+        bucket_name='bench', endpoint_url='https://s3.example.com', access_key='bench', secret_key='bench',
+        region_name='us-east-1', addressing_style='path', signature_version='s3v4',
+    )
+    products = list(Product.objects.select_related('category').prefetch_related('images')[:page_size])
+    result = {
+        'products': len(products),
+        'urls_per_page': sum(1 + len(product.images.all()) + bool(product.video) for product in products),
+    }
+    with mock.patch.object(default_storage, '_wrapped', storage):
+        for mode, public in (('boto3_ms', False), ('public_ms', True)):
+            with override_settings(MEDIA_PUBLIC_URLS=public, MEDIA_URL='https://media.example.com/bench/'):
+                ProductSerializer(products, many=True).data
+                timings = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    ProductSerializer(products, many=True).data
+                    timings.append(time.perf_counter() - started)
+            result[mode] = round(min(timings) * 1000, 2)
+    return result
+
@@ -0,0 +1,62 @@
+"""
+Bestseller flags computed from sales.
+
+Products are ranked by units sold over a sliding window, read from the
+per-product sales rollups (api.rollups) with one grouped query, so the cost
+depends on days x products in the window rather than on how many order
+items exist. Only flags that actually change are written, in a single
+bulk_update, followed by a refresh of those products' snapshots
+(api.snapshots) and one bump of the 'catalog' cache version.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import snapshots
+from .caching import bump_version
+from .models import Product, SalesRollup
+from .rollups import ORDER_TOTALS, REVENUE_STATUSES
+
+
+def rank(days=None, limit=None, statuses=None):
+    """Return [(product_id, units)] for the top sellers, best first."""
+    days = days or settings.BESTSELLER_WINDOW_DAYS
+    limit = limit or settings.BESTSELLER_COUNT
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = (
+        SalesRollup.objects
+        .filter(day__gte=since, status__in=statuses or REVENUE_STATUSES)
+        .exclude(product_id=ORDER_TOTALS)
+        .values('product_id')
+        .annotate(sold=Sum('units'))
+        .filter(sold__gt=0)
+        .order_by('-sold', 'product_id')
+        .values_list('product_id', 'sold')[:limit]
+    )
+    return list(rows)
+
+
+def update(days=None, limit=None, dry_run=False):
+    """
+    Flag the current top sellers and unflag everything else. Returns
+    (ranking, flagged_ids, unflagged_ids).
+    """
+    ranking = rank(days, limit)
+    top = {product_id for product_id, _ in ranking}
+    current = set(Product.objects.filter(bestseller=True).values_list('id', flat=True))
+    # Rollup rows outlive deleted products; ignore ids that no longer exist
+    flag = set(Product.objects.filter(id__in=top - current).values_list('id', flat=True))
+    unflag = current - top
+    if dry_run or not (flag or unflag):
+        return ranking, flag, unflag
+
+    products = [Product(id=pk, bestseller=True) for pk in flag]
+    products += [Product(id=pk, bestseller=False) for pk in unflag]
+    with transaction.atomic():
+        Product.objects.bulk_update(products, ['bestseller'], batch_size=1000)
+        snapshots.refresh(flag | unflag)
+    bump_version('catalog')
+    return ranking, flag, unflag
@@ -0,0 +1,88 @@
+"""
+Currency rates from the CurrencyRate table, cached in each process.
+
+Every process keeps the whole (tiny) rate table in memory and only checks
+whether the table changed (the newest updated_at and the row count, one
+small aggregate) every CURRENCY_RATES_CHECK_INTERVAL seconds, so a
+conversion normally costs no I/O at all. The check goes to the database
+rather than the cache so it works without a shared cache: rates saved by
+the refresh_currency_rates job or another worker reach every process
+within the interval. The process that saved a rate drops its copy
+immediately (see api.signals).
+"""
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+BASE_CURRENCY = 'USD'
+CENTS = Decimal('0.01')
+
+_lock = threading.Lock()
+_state = {'rates': None, 'marker': None, 'checked_at': 0.0}
+
+
+def _marker():
+    from .models import CurrencyRate
+    return tuple(CurrencyRate.objects.aggregate(Max('updated_at'), Count('code')).values())
+
+
+def _load():
+    from .models import CurrencyRate
+    return {
+        rate.code: {'rate': rate.rate, 'symbol': rate.symbol}
+        for rate in CurrencyRate.objects.all()
+    }
+
+
+def get_rates():
+    """Return {code: {'rate': Decimal, 'symbol': str}}."""
+    now = time.monotonic()
+    rates = _state['rates']
+    if rates is not None and now - _state['checked_at'] < settings.CURRENCY_RATES_CHECK_INTERVAL:
+        return rates
+
+    with _lock:
+        marker = _marker()
+        if _state['rates'] is None or _state['marker'] != marker:
+            _state['rates'] = _load()
+            _state['marker'] = marker
+        _state['checked_at'] = now
+        return _state['rates']
+
+
+def get_rate(code):
+    entry = get_rates().get((code or '').upper())
+    return entry['rate'] if entry else None
+
+
+def get_symbol(code, default='$'):
+    entry = get_rates().get((code or '').upper())
+    return entry['symbol'] if entry and entry['symbol'] else default
+
+
+def convert(amount, rate):
+    return (Decimal(amount) * rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def invalidate():
+    with _lock:
+        _state['rates'] = None
+
+
+def localize_prices(rows, code):
+    """
+    Add prices converted to `code` to serialized products in place, looking
+    the rate up once for the whole page.
+    """
+    code = code.upper()
+    rate = get_rate(code)
+    symbol = get_symbol(code)
+    for row in rows:
+        row['currency'] = code
+        row['currency_symbol'] = symbol
+        row['local_price'] = str(convert(row['price'], rate))
+        row['local_delivery_charges'] = str(convert(row['delivery_charges'], rate))
+    return rows
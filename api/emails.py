@@ -3,6 +3,8 @@ from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
 
+from core.metrics import track_external
+
 
 def send_order_confirmation_email(order):
     subject = f'Order Confirmation #{order.id}'
@@ -39,25 +41,27 @@ def send_order_confirmation_email(order):
     
     try:
         # Send to customer
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=[order.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
+        with track_external('smtp', 'send_mail'):
+            send_mail(
+                subject=subject,
+                message=plain_message,
+                from_email=settings.EMAIL_HOST_USER,
+                recipient_list=[order.email],
+                html_message=html_message,
+                fail_silently=False,
+            )
         
         # Send notification to admin
         admin_subject = f'NEW ORDER RECEIVED: #{order.id}'
-        send_mail(
-            subject=admin_subject,
-            message=plain_message,
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=[settings.EMAIL_HOST_USER],
-            html_message=html_message,
-            fail_silently=False,
-        )
+        with track_external('smtp', 'send_mail'):
+            send_mail(
+                subject=admin_subject,
+                message=plain_message,
+                from_email=settings.EMAIL_HOST_USER,
+                recipient_list=[settings.EMAIL_HOST_USER],
+                html_message=html_message,
+                fail_silently=False,
+            )
         return True
     except Exception as e:
         print(f"Error sending order confirmation email to {order.email}: {e}")
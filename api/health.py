@@ -0,0 +1,113 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+HEALTH_CACHE_KEY = 'health:readiness'
+HEALTH_STORAGE_KEY = 'health/.probe'
+
+
+def check_database():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1;')
+        cursor.fetchone()
+
+
+def check_cache():
+    token = str(time.monotonic())
+    cache.set(HEALTH_CACHE_KEY, token, timeout=60)
+    if cache.get(HEALTH_CACHE_KEY) != token:
+        raise RuntimeError('cache did not return the value just written')
+
+
+def check_storage():
+    # exists() is a stat on local disk and a HEAD request on S3, which is
+    # enough to prove credentials and connectivity without writing anything.
+    default_storage.exists(HEALTH_STORAGE_KEY)
+
+
+CHECKS = {
+    'database': check_database,
+    'cache': check_cache,
+    'storage': check_storage,
+}
+
+
+class ReadinessMonitor:
+    """
+    Runs the readiness checks on a background thread every `interval`
+    seconds and keeps the last result in memory, so probes never wait on a
+    slow or unreachable dependency.
+    """
+
+    def __init__(self, interval, checks=None):
+        self.interval = interval
+        self.checks = checks or CHECKS
+        self._result = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='readiness-monitor', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_checks()
+            finally:
+                # Don't sit on a connection between checks; with DB_POOL it
+                # goes back to the pool for requests to use.
+                connection.close()
+            time.sleep(self.interval)
+
+    def run_checks(self):
+        close_old_connections()
+        checks = {}
+        for name, check in self.checks.items():
+            started = time.monotonic()
+            try:
+                check()
+                checks[name] = {'ok': True}
+            except Exception as e:
+                checks[name] = {'ok': False, 'error': str(e)}
+            checks[name]['latency_ms'] = round((time.monotonic() - started) * 1000, 2)
+
+        # Swap in the whole result at once; readers never see a partial update.
+        self._result = {
+            'ready': all(check['ok'] for check in checks.values()),
+            'checks': checks,
+            'checked_at': timezone.now(),
+            'checked_at_monotonic': time.monotonic(),
+        }
+        return self._result
+
+    def snapshot(self):
+        result = self._result
+        if result is None:
+            return {'status': 'starting', 'age_seconds': None, 'checks': {}}
+
+        age = time.monotonic() - result['checked_at_monotonic']
+        # A result older than a few intervals means the monitor thread is
+        # stuck (e.g. hanging on a DB connect), so stop reporting ready.
+        stale = age > self.interval * 3
+        return {
+            'status': 'ready' if result['ready'] and not stale else 'not_ready',
+            'stale': stale,
+            'checked_at': result['checked_at'].isoformat(),
+            'age_seconds': round(age, 3),
+            'checks': result['checks'],
+        }
+
+
+monitor = ReadinessMonitor(interval=getattr(settings, 'HEALTH_CHECK_INTERVAL', 15))
@@ -0,0 +1,172 @@
+"""
+Stock tracking for limited products.
+
+Product.stock is null for products we don't count. For the others,
+checkout reserves stock with one conditional UPDATE per product
+
+    UPDATE product SET stock = stock - n WHERE id = ? AND stock >= n
+
+run in autocommit, so a hot row is locked for the duration of a single
+statement rather than a whole checkout, and products are always taken in id
+order so checkouts can't deadlock each other. A decrement that matches no
+row means the product sold out: anything already taken is put back and the
+checkout is refused.
+
+Reserved stock stays off the shelf while the customer is on Stripe. It is
+released when the session expires (webhook), the order is cancelled, or
+the reservation runs out (release_expired_reservations); a completed
+payment just drops the reservation rows.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+
+class OutOfStock(Exception):
+    def __init__(self, available):
+        # {product_id: units still available}
+        self.available = available
+        super().__init__('Some items are no longer available in the requested quantity')
+
+
+class Reservation:
+    """Stock taken off the shelf for one checkout."""
+
+    def __init__(self, quantities):
+        self.quantities = quantities
+        self.expires_at = self.expiry()
+        self.order = None
+
+    @staticmethod
+    def expiry():
+        return timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+
+    def hold(self, order):
+        """Record the reserved stock against the order that now owns it."""
+        StockReservation.objects.bulk_create([
+            StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=self.expires_at)
+            for product_id, quantity in self.quantities.items()
+        ])
+        self.order = order
+
+    def cancel(self):
+        """Put the stock back after a checkout failed part way."""
+        if self.order is not None:
+            release(StockReservation.objects.filter(order=self.order))
+        else:
+            restock(self.quantities)
+
+    def session_params(self):
+        """
+        Stripe session arguments that expire the session with the
+        reservation, so the customer can't pay for stock that has been
+        released. Call it right before creating the session: Stripe wants
+        `expires_at` at least 30 minutes after creation, so the expiry is
+        taken now, and the held reservations move to match it.
+        """
+        if not self.quantities:
+            return {}
+        self.expires_at = self.expiry().replace(microsecond=0)
+        if self.order is not None:
+            StockReservation.objects.filter(order=self.order).update(expires_at=self.expires_at)
+        return {'expires_at': int(self.expires_at.timestamp())}
+
+
+def tracked_quantities(lines):
+    """{product_id: quantity} for the tracked products among (product, quantity) lines."""
+    quantities = {}
+    for product, quantity in lines:
+        if product.stock is not None:
+            quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+    return quantities
+
+
+def reserve(quantities):
+    """
+    Take {product_id: quantity} off the shelf. Raises OutOfStock, with
+    everything already taken put back, if any product runs short.
+    """
+    taken = {}
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        updated = Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+        if not updated:
+            restock(taken)
+            available = dict(
+                Product.objects.filter(pk__in=list(quantities), stock__isnull=False).values_list('pk', 'stock')
+            )
+            raise OutOfStock({
+                pk: available.get(pk, 0) for pk, wanted in quantities.items() if available.get(pk, 0) < wanted
+            })
+        taken[product_id] = quantity
+    return Reservation(taken)
+
+
+def adjust(product_id, delta):
+    """
+    Add `delta` units to a product's stock (negative to take some away) in
+    one conditional UPDATE, so reservations made meanwhile are kept. An
+    untracked product starts being tracked. Returns the new stock; raises
+    OutOfStock if taking away more than is on the shelf.
+    """
+    products = Product.objects.filter(pk=product_id)
+    if delta < 0:
+        products = products.filter(stock__gte=-delta)
+    if not products.update(stock=Coalesce(F('stock'), 0) + delta):
+        available = Product.objects.filter(pk=product_id).values_list('stock', flat=True).first()
+        raise OutOfStock({product_id: available or 0})
+    return Product.objects.values_list('stock', flat=True).get(pk=product_id)
+
+
+def restock(quantities):
+    for product_id in sorted(quantities):
+        Product.objects.filter(pk=product_id, stock__isnull=False).update(stock=F('stock') + quantities[product_id])
+
+
+def release(reservations):
+    """
+    Put reserved stock back and delete the reservations. Rows another
+    process is already releasing are skipped, so stock is never returned
+    twice. Returns the number of reservations released.
+    """
+    with transaction.atomic():
+        rows = list(
+            reservations.select_for_update(skip_locked=True).values_list('id', 'product_id', 'quantity')
+        )
+        if not rows:
+            return 0
+        StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+        quantities = {}
+        for _, product_id, quantity in rows:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        restock(quantities)
+    return len(rows)
+
+
+def confirm(order):
+    """The order (or order id) was paid: its stock is sold for good."""
+    StockReservation.objects.filter(order=order).delete()
+
+
+def release_expired(batch_size=500):
+    """Release reservations past their expiry plus the webhook grace period."""
+    cutoff = timezone.now() - timedelta(minutes=settings.STOCK_RESERVATION_GRACE_MINUTES)
+    released = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(expires_at__lt=cutoff)
+            .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return released
+        count = release(StockReservation.objects.filter(id__in=ids))
+        released += count
+        if count < len(ids):
+            # the rest are being released elsewhere right now
+            return released
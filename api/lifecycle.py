@@ -0,0 +1,116 @@
+"""
+Housekeeping for old orders.
+
+Checkout creates a pending order before sending the customer to Stripe, so
+abandoned carts leave pending orders behind. expire_pending() cancels the
+ones older than PENDING_ORDER_TTL_HOURS that were never paid (orders paid on
+Stripe stay pending until an admin verifies them) a batch at a time: each batch is
+found through the (status, created_at) index and cancelled in its own
+short transaction, so the live order tables are never locked for long.
+
+archive() moves delivered and cancelled orders older than
+ORDER_ARCHIVE_AFTER_DAYS into ArchivedOrder the same way, so admin pages,
+exports and status queries stop scanning them. get_order() reads through
+to the archive for the few places that still look old orders up by id.
+Sales rollups keep counting archived orders; they are never adjusted on
+archive. delete_orders() is for the admin deleting orders outright, which
+does take them out of the rollups.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import inventory, rollups
+from .models import ArchivedOrder, Order, StockReservation
+
+ARCHIVE_STATUSES = ['delivered', 'cancelled']
+
+
+def expire_pending(hours=None, batch_size=500, pause=0, log=print):
+    """Cancel pending orders older than `hours`. Returns how many were cancelled."""
+    hours = settings.PENDING_ORDER_TTL_HOURS if hours is None else hours
+    cutoff = timezone.now() - timedelta(hours=hours)
+    expired = 0
+    while True:
+        count = _expire_batch(cutoff, batch_size)
+        if not count:
+            return expired
+        expired += count
+        log(f'cancelled {count} pending orders ({expired} so far)')
+        if pause:
+            # give the live traffic room between batches
+            time.sleep(pause)
+
+
+def _expire_batch(cutoff, batch_size):
+    with transaction.atomic():
+        # Orders being paid or edited right now are locked; skip them and
+        # leave them for the next run.
+        ids = list(
+            Order.objects.filter(status='pending', created_at__lt=cutoff, paid_at__isnull=True)
+            .order_by('created_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        Order.objects.filter(id__in=ids).update(status='cancelled')
+        # update() skips the post_save signals, so do their work for the batch
+        orders = Order.objects.filter(id__in=ids).prefetch_related('items')
+        rollups.move_orders(orders, 'pending', 'cancelled')
+        inventory.release(StockReservation.objects.filter(order_id__in=ids))
+    return len(ids)
+
+
+def archive(days=None, batch_size=500, pause=0, log=print):
+    """Move old finished orders to ArchivedOrder. Returns how many were moved."""
+    days = settings.ORDER_ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    archived = 0
+    while True:
+        count = _archive_batch(cutoff, batch_size)
+        if not count:
+            return archived
+        archived += count
+        log(f'archived {count} orders ({archived} so far)')
+        if pause:
+            time.sleep(pause)
+
+
+def _archive_batch(cutoff, batch_size):
+    with transaction.atomic():
+        ids = list(
+            Order.objects.filter(status__in=ARCHIVE_STATUSES, created_at__lt=cutoff)
+            .order_by('created_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        orders = Order.objects.filter(id__in=ids).prefetch_related('items')
+        ArchivedOrder.objects.bulk_create([ArchivedOrder.from_order(order) for order in orders])
+        Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def delete_orders(orders):
+    """Delete orders (a queryset) and take them out of the sales rollups."""
+    with transaction.atomic():
+        orders = list(orders.select_for_update().prefetch_related('items'))
+        rollups.remove_orders(orders)
+        Order.objects.filter(id__in=[order.id for order in orders]).delete()
+
+
+def get_order(order_id):
+    """
+    The order with its items prefetched, from the live table or else the
+    archive (a read-only copy with `archived` set). None if neither has it.
+    """
+    order = Order.objects.prefetch_related('items').filter(id=order_id).first()
+    if order is not None:
+        return order
+    archived = ArchivedOrder.objects.filter(id=order_id).first()
+    return archived.restore() if archived else None
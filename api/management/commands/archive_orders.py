@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api import lifecycle
+
+
+class Command(BaseCommand):
+    help = (
+        'Move delivered and cancelled orders older than ORDER_ARCHIVE_AFTER_DAYS '
+        'out of the live order tables into ArchivedOrder, in small batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Age threshold (default: ORDER_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        archived = lifecycle.archive(
+            days=options['days'], batch_size=options['batch_size'], pause=options['pause'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders.'))
@@ -0,0 +1,77 @@
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.benchmark import SCENARIOS, compare, dataset_summary, fake_externals, run_scenario
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the catalog, checkout, webhook, export and receipt endpoints at the '
+        'given concurrency levels and save throughput, latency percentiles and '
+        'queries per request to a JSON file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'Comma-separated, from: {", ".join(SCENARIOS)}')
+        parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated thread counts')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level')
+        parser.add_argument('--output-dir', default=settings.BENCH_RESULTS_DIR)
+        parser.add_argument('--compare', help='Earlier results file to compare against (default: the latest one)')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        previous_path = options['compare'] or self.latest_result(output_dir)
+
+        run = {
+            'started_at': timezone.now().isoformat(),
+            'dataset': dataset_summary(),
+            'results': [],
+        }
+        self.stdout.write(f"Dataset: {run['dataset']}")
+
+        with fake_externals():
+            for name in scenarios:
+                for level in levels:
+                    result = run_scenario(name, level, options['requests'])
+                    run['results'].append(result)
+                    self.stdout.write(
+                        f"{name:<10} c={level:<3} {result['throughput_rps']} req/s  "
+                        f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms  "
+                        f"queries={result['queries_per_request']} errors={result['errors']}"
+                    )
+                    if 'db_pool' in result:
+                        stats = result['db_pool']
+                        self.stdout.write(
+                            f"{'':<10} pool size={stats.get('pool_size')}/{stats.get('pool_max')} "
+                            f"queued={stats.get('requests_queued', 0)} "
+                            f"wait_ms={stats.get('requests_wait_ms', 0)} timeouts={stats.get('requests_errors', 0)}"
+                        )
+
+        path = output_dir / f"bench-{timezone.now().strftime('%Y%m%d-%H%M%S')}.json"
+        path.write_text(json.dumps(run, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Saved {path}'))
+
+        if previous_path:
+            previous = json.loads(Path(previous_path).read_text())
+            self.stdout.write(f'Compared with {previous_path}:')
+            for (name, level), metric, old, new in compare(run, previous):
+                if old is None or new is None:
+                    continue
+                change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+                self.stdout.write(f'  {name:<10} c={level:<3} {metric:<20} {old} -> {new} ({change})')
+
+    def latest_result(self, output_dir):
+        results = sorted(output_dir.glob('bench-*.json'), key=os.path.getmtime)
+        return str(results[-1]) if results else None
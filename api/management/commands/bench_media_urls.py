@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.benchmark import media_url_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare product list serialization time with presigned boto3 media '
+        'URLs and with public MEDIA_URL ones (see core.storage.MediaStorage).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=500)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        result = media_url_benchmark(options['page_size'], options['rounds'])
+        self.stdout.write(
+            f"{result['products']} products, {result['urls_per_page']} media URLs per page: "
+            f"boto3 {result['boto3_ms']}ms, public {result['public_ms']}ms"
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Update "frequently bought together" recommendations with orders placed '
+        'since the last run, or rebuild them from all orders with --full.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute from the whole order history')
+        parser.add_argument('--top', type=int, help='Recommendations per product (default: RECOMMENDATION_COUNT)')
+        parser.add_argument('--chunk-size', type=int, default=recommendations.ORDER_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['full']:
+            count = recommendations.rebuild(options['top'], options['chunk_size'], log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f'Stored {count} recommendations.'))
+        else:
+            count = recommendations.refresh(options['top'], options['chunk_size'], log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f'Updated recommendations for {count} products.'))
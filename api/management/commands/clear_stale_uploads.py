@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api import uploads
+
+
+class Command(BaseCommand):
+    help = (
+        'Attach fully received video uploads whose last request failed to, and delete '
+        'uploads that have not received a chunk for UPLOAD_EXPIRY_HOURS, along with '
+        'their temporary part files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None)
+
+    def handle(self, *args, **options):
+        finished = uploads.finish_pending()
+        if finished:
+            self.stdout.write(f'Attached {finished} fully received uploads.')
+        cleared = uploads.clear_stale(hours=options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'Cleared {cleared} stale uploads.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api import lifecycle
+
+
+class Command(BaseCommand):
+    help = (
+        'Cancel pending orders older than PENDING_ORDER_TTL_HOURS (abandoned '
+        'checkouts), in small batches with one short transaction each.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, help='Age threshold (default: PENDING_ORDER_TTL_HOURS)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        expired = lifecycle.expire_pending(
+            hours=options['hours'], batch_size=options['batch_size'], pause=options['pause'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Cancelled {expired} abandoned pending orders.'))
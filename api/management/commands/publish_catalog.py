@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import publisher
+
+
+class Command(BaseCommand):
+    help = (
+        'Publish the catalog as static JSON files to storage if it no longer '
+        'matches the published manifest (see api.publisher).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Publish even if nothing changed or CATALOG_PUBLISH is off')
+
+    def handle(self, *args, **options):
+        if options['force']:
+            manifest = publisher.publish()
+        elif not settings.CATALOG_PUBLISH:
+            self.stdout.write('CATALOG_PUBLISH is off; nothing to do.')
+            return
+        else:
+            manifest = publisher.publish_if_changed()
+        if manifest is None:
+            self.stdout.write('Published catalog is current.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Published catalog version {manifest['version']}."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-render the stored JSON snapshot of every product (see api.snapshots), '
+        'in batches spread over several worker processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=snapshots.BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        count = snapshots.rebuild(
+            batch_size=options['batch_size'], workers=options['workers'], log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} product snapshots.'))
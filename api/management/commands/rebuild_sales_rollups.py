@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the sales rollup table from orders, aggregating one chunk of '
+        'order ids at a time. Checkouts wait while it runs, so run it when '
+        'order traffic is quiet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rollups.rebuild(chunk_size=options['chunk_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Sales rollups rebuilt.'))
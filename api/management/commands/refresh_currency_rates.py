@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api import currency
+from api.models import CurrencyRate
+
+
+class Command(BaseCommand):
+    help = (
+        'Update CurrencyRate from CURRENCY_RATES_URL, a JSON endpoint returning '
+        '{"rates": {"GBP": 0.79, ...}} relative to USD. Only currencies already '
+        'in the table are updated.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=settings.CURRENCY_RATES_URL)
+
+    def handle(self, *args, **options):
+        if not options['url']:
+            raise CommandError('No rates source configured; set CURRENCY_RATES_URL or pass --url.')
+
+        try:
+            response = requests.get(options['url'], timeout=10)
+            response.raise_for_status()
+            fetched = response.json()['rates']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise CommandError(f'Could not fetch currency rates: {e}')
+
+        updated = []
+        now = timezone.now()
+        with transaction.atomic():
+            for rate in CurrencyRate.objects.select_for_update():
+                if rate.code == currency.BASE_CURRENCY or rate.code not in fetched:
+                    continue
+                rate.rate = Decimal(str(fetched[rate.code]))
+                rate.updated_at = now
+                updated.append(rate)
+            CurrencyRate.objects.bulk_update(updated, ['rate', 'updated_at'])
+
+        # bulk_update skips post_save, so invalidate once here
+        currency.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {len(updated)} rates: {', '.join(f'{r.code}={r.rate}' for r in updated)}"
+        ))
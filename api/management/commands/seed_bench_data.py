@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import seed
+
+
+class Command(BaseCommand):
+    help = 'Bulk-insert synthetic products, galleries, collections and orders for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--images', type=int, default=3, help='Gallery images per product')
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--max-items', type=int, default=4, help='Maximum line items per order')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--force', action='store_true', help='Allow running with DEBUG off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to seed benchmark data with DEBUG off; pass --force if this is not production.')
+
+        seed(
+            products=options['products'],
+            images_per_product=options['images'],
+            orders=options['orders'],
+            max_items=options['max_items'],
+            batch_size=options['batch_size'],
+            random_seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS('Benchmark data seeded.'))
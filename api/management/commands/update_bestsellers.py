@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api import bestsellers
+
+
+class Command(BaseCommand):
+    help = (
+        'Flag the products with the most units sold over the last '
+        'BESTSELLER_WINDOW_DAYS days as bestsellers and unflag the rest.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Window size in days (default: BESTSELLER_WINDOW_DAYS)')
+        parser.add_argument('--limit', type=int, help='Number of bestsellers (default: BESTSELLER_COUNT)')
+        parser.add_argument('--dry-run', action='store_true', help='Show the ranking without saving it')
+
+    def handle(self, *args, **options):
+        ranking, flagged, unflagged = bestsellers.update(
+            days=options['days'], limit=options['limit'], dry_run=options['dry_run'],
+        )
+        for position, (product_id, units) in enumerate(ranking, start=1):
+            self.stdout.write(f'{position:>3}. product {product_id}: {units} sold')
+        verb = 'Would flag' if options['dry_run'] else 'Flagged'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {len(flagged)} and unflagged {len(unflagged)} products.'
+        ))
@@ -0,0 +1,88 @@
+"""
+Helpers for serving uploaded media (product videos in particular) from
+local storage.
+
+Browsers seek in a video with Range requests, so the media view answers a
+single `bytes=` range with 206 and only the requested bytes. Files are
+handed to FileResponse, which lets gunicorn sendfile() them straight from
+the page cache instead of copying them through Python. The ETag is a hash
+of the file contents, computed once per version of the file and cached.
+"""
+import hashlib
+import re
+
+from django.core.cache import cache
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Unsatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    The (start, end) bytes, inclusive, asked for by a Range header. None
+    means send the whole file: no header, a header we don't understand, or
+    several ranges. Raises Unsatisfiable if the range starts past the end.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # bytes=-N: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise Unsatisfiable()
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise Unsatisfiable()
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def content_etag(path, stat):
+    """Hash of the file's contents, recomputed only when it changes."""
+    key = 'media-etag:' + hashlib.md5(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+    etag = cache.get(key)
+    if etag is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        etag = f'"{digest.hexdigest()[:32]}"'
+        cache.set(key, etag, None)
+    return etag
+
+
+class FileRange:
+    """
+    `length` bytes of an open file starting at `start`, for FileResponse.
+    fileno() is kept so the server can still sendfile() from the file's
+    current offset, limited by the Content-Length we set.
+    """
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.file = f
+        self.name = f.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
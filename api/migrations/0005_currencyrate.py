@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:01
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# The rates that used to be hardcoded in payments/views.py
+INITIAL_RATES = {
+    "USD": (Decimal("1"), "$"),
+    "GBP": (Decimal("0.79"), "£"),
+    "AED": (Decimal("3.67"), "د.إ"),
+    "AUD": (Decimal("1.52"), "A$"),
+}
+
+
+def seed_rates(apps, schema_editor):
+    CurrencyRate = apps.get_model('api', 'CurrencyRate')
+    for code, (rate, symbol) in INITIAL_RATES.items():
+        CurrencyRate.objects.get_or_create(code=code, defaults={'rate': rate, 'symbol': symbol})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_order_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRate',
+            fields=[
+                ('code', models.CharField(max_length=3, primary_key=True, serialize=False)),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=14)),
+                ('symbol', models.CharField(blank=True, max_length=8)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_rates, migrations.RunPython.noop),
+    ]
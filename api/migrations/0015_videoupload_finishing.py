@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-19 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_order_paid_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videoupload',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('finishing', 'Finishing'), ('complete', 'Complete')], default='uploading', max_length=20),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-19 21:40
+
+from django.db import migrations
+
+
+def clear_snapshots(apps, schema_editor):
+    # Snapshots used to hold media URLs rather than storage names; they are
+    # rebuilt the first time each product is read.
+    apps.get_model('api', 'ProductSnapshot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_videoupload_finishing'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,7 @@
+import uuid
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -20,15 +24,41 @@ class Product(models.Model):
     delivery_charges = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     featured = models.BooleanField(default=False)
     bestseller = models.BooleanField(default=False)
+    # Units on the shelf; null means stock isn't tracked (see api.inventory)
+    stock = models.PositiveIntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Stock only moves through the conditional UPDATEs in api.inventory.
+        # An edit must not write back the stock it read, or reservations
+        # made since would be undone; pass update_fields=['stock'] to set it.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'stock' and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/images/')
 
+class ProductSnapshot(models.Model):
+    """
+    The product as ProductSerializer renders it, kept up to date on write
+    so the catalog read path can skip the serializer (see api.snapshots).
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='snapshot', on_delete=models.CASCADE)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Snapshot of product {self.product_id}"
+
 class Collection(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
@@ -62,11 +92,33 @@ class Order(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2)
     shipping = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Checkout Session the customer pays through; the confirmation page
+    # looks the order up by it
+    stripe_session_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    # Set by the checkout.session.completed webhook. The order stays pending
+    # until an admin verifies the payment, but is never expired meanwhile.
+    paid_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # expire_pending_orders walks old pending orders in batches
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.first_name} {self.last_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the sales rollups were given for this order so saves
+        # can tell when it changed (see api.rollups).
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_total = instance.__dict__.get('total')
+        instance._loaded_currency = instance.__dict__.get('currency')
+        return instance
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
@@ -77,3 +129,153 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} x {self.name}"
+
+class ArchivedOrder(models.Model):
+    """
+    An old delivered/cancelled order moved out of the live tables (see
+    api.lifecycle). `data` holds the order's and its items' field values.
+    """
+    id = models.BigIntegerField(primary_key=True)  # the original order id
+    email = models.EmailField(db_index=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        return f"Archived order {self.id}"
+
+    @classmethod
+    def from_order(cls, order):
+        return cls(
+            id=order.id,
+            email=order.email,
+            status=order.status,
+            created_at=order.created_at,
+            data={
+                'order': _field_values(order),
+                'items': [_field_values(item) for item in order.items.all()],
+            },
+        )
+
+    def restore(self):
+        """
+        Rebuild the order as a read-only Order whose `items` work as if
+        prefetched, so serializers and the receipt can use it unchanged.
+        """
+        order = _from_field_values(Order, self.data['order'])
+        order._prefetched_objects_cache = {
+            'items': [_from_field_values(OrderItem, item) for item in self.data['items']],
+        }
+        order.archived = True
+        return order
+
+def _field_values(instance):
+    values = {}
+    for field in instance._meta.concrete_fields:
+        value = getattr(instance, field.attname)
+        # DjangoJSONEncoder would cut datetimes to milliseconds
+        values[field.attname] = value.isoformat() if isinstance(value, datetime) else value
+    return values
+
+def _from_field_values(model, values):
+    return model(**{
+        field.attname: field.to_python(values[field.attname])
+        for field in model._meta.concrete_fields if field.attname in values
+    })
+
+class StockReservation(models.Model):
+    # Stock held for a pending order while the customer pays on Stripe
+    order = models.ForeignKey(Order, related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity} x product {self.product_id} for order {self.order_id}"
+
+class CurrencyRate(models.Model):
+    # Units of this currency per 1 unit of the base currency (USD)
+    code = models.CharField(max_length=3, primary_key=True)
+    rate = models.DecimalField(max_digits=14, decimal_places=6)
+    symbol = models.CharField(max_length=8, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.code} {self.rate}"
+
+class SalesRollup(models.Model):
+    """
+    Revenue, order count and units per day x product x currency x status,
+    maintained incrementally by api.rollups. product_id 0 holds the
+    whole-order totals (order.total, one count per order).
+    """
+    day = models.DateField()
+    product_id = models.BigIntegerField(default=0)
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'product_id', 'currency', 'status'], name='unique_sales_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id} {self.currency} {self.status}"
+
+class ProductRecommendation(models.Model):
+    """
+    "Frequently bought together": the top co-purchased products for each
+    product, scored by how many orders contained both (see api.recommendations).
+    """
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_product_recommendation'),
+        ]
+        indexes = [models.Index(fields=['product', '-score'], name='recommendation_rank_idx')]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.score})"
+
+class JobCursor(models.Model):
+    # How far an incremental background job has read its input, e.g. the
+    # last order id folded into the recommendations.
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+class VideoUpload(models.Model):
+    """
+    A resumable, chunked upload of a product video. Chunks are appended to
+    a temporary file until `received` reaches `size`; the file is then
+    attached to the product (see api.uploads).
+    """
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('finishing', 'Finishing'),
+        ('complete', 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, related_name='video_uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} for product {self.product_id} ({self.received}/{self.size})"
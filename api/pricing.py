@@ -0,0 +1,136 @@
+"""
+Server-side cart pricing.
+
+A quote prices a cart with one product query and the cached rate table, and
+comes back with a signed token. Checkout can accept that token and create
+the order from it directly instead of trusting client prices or repricing.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+
+from .currency import BASE_CURRENCY, convert, get_rate, get_symbol
+from .models import Order, OrderItem, Product
+from .rollups import record_order
+
+QUOTE_SALT = 'api.pricing.quote'
+
+
+class QuoteError(Exception):
+    pass
+
+
+def _parse_items(items):
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise QuoteError('Items must be a list of objects with a product and quantity')
+    quantities = {}
+    for item in items:
+        product = item.get('product')
+        product_id = product.get('id') if isinstance(product, dict) else product
+        try:
+            product_id = int(product_id)
+            quantity = int(item.get('quantity') or 1)
+        except (TypeError, ValueError):
+            raise QuoteError('Each item needs a numeric product id and quantity')
+        if quantity < 1:
+            raise QuoteError('Quantity must be at least 1')
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def shipping_for(products):
+    # One delivery charge per order: the highest among the cart's products.
+    return max((product.delivery_charges for product in products), default=Decimal('0'))
+
+
+def build_quote(items, currency=BASE_CURRENCY):
+    if not items:
+        raise QuoteError('Items are required')
+    currency = (currency or BASE_CURRENCY).upper()
+    rate = get_rate(currency)
+    if rate is None:
+        raise QuoteError(f'Unsupported currency: {currency}')
+
+    quantities = _parse_items(items)
+    products = Product.objects.only('id', 'name', 'price', 'delivery_charges', 'image', 'stock').in_bulk(quantities)
+    missing = [str(pk) for pk in quantities if pk not in products]
+    if missing:
+        raise QuoteError(f"Products not found: {', '.join(missing)}")
+    short = [
+        products[pk].name for pk, quantity in quantities.items()
+        if products[pk].stock is not None and products[pk].stock < quantity
+    ]
+    if short:
+        raise QuoteError(f"Not enough stock for: {', '.join(short)}")
+
+    lines = []
+    subtotal = Decimal('0.00')
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        unit_price = convert(product.price, rate)
+        line_total = unit_price * quantity
+        subtotal += line_total
+        lines.append({
+            'product_id': product_id,
+            'name': product.name,
+            'quantity': quantity,
+            'unit_price': str(unit_price),
+            'line_total': str(line_total),
+            'image_url': product.image.url if product.image else '',
+            # stock is reserved for tracked products at checkout
+            'tracked': product.stock is not None,
+        })
+
+    shipping = convert(shipping_for(products.values()), rate)
+    quote = {
+        'currency': currency,
+        'currency_symbol': get_symbol(currency),
+        'lines': lines,
+        'subtotal': str(subtotal),
+        'shipping': str(shipping),
+        'total': str(subtotal + shipping),
+    }
+    quote['quote'] = signing.dumps(quote, salt=QUOTE_SALT, compress=True)
+    quote['expires_in'] = settings.CART_QUOTE_MAX_AGE
+    return quote
+
+
+def load_quote(token):
+    """Return the quote a token was issued for; raises QuoteError if it was
+    tampered with or is older than CART_QUOTE_MAX_AGE."""
+    try:
+        return signing.loads(token, salt=QUOTE_SALT, max_age=settings.CART_QUOTE_MAX_AGE)
+    except signing.SignatureExpired:
+        raise QuoteError('Quote has expired, please refresh your cart')
+    except signing.BadSignature:
+        raise QuoteError('Invalid quote')
+
+
+def tracked_quantities(quote):
+    """{product_id: quantity} of the quote's lines whose stock must be reserved."""
+    return {line['product_id']: line['quantity'] for line in quote['lines'] if line.get('tracked')}
+
+
+def create_order_from_quote(quote, **customer):
+    """Create a pending order and its items straight from a verified quote."""
+    order = Order.objects.create(
+        total=Decimal(quote['total']),
+        shipping=Decimal(quote['shipping']),
+        currency=quote['currency'],
+        status='pending',
+        **customer,
+    )
+    items = OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product_id=line['product_id'],
+            name=line['name'],
+            price=Decimal(line['unit_price']),
+            quantity=line['quantity'],
+            image_url=line['image_url'],
+        )
+        for line in quote['lines']
+    ])
+    record_order(order, items)
+    return order
@@ -0,0 +1,180 @@
+"""
+Static catalog files for the storefront.
+
+The storefront is a static app; instead of asking the API for products,
+categories and collections on every visit (and waking a cold instance) it
+can read gzipped JSON files from the media bucket's CDN. publish() renders
+the whole catalog, plus one file per category and per collection, under a
+new version directory, then points CATALOG_PUBLISH_PREFIX/manifest.json at
+it and removes all but the newest CATALOG_PUBLISH_KEEP versions. Versioned
+files never change, so they are cached for a year; only the manifest is
+short-lived.
+
+The manifest records a digest of the rendered catalog, and
+publish_if_changed() only uploads when the catalog no longer matches it, so
+it can run as often as needed from any process. With CATALOG_PUBLISH on,
+catalog writes (api.signals) schedule one CATALOG_PUBLISH_DELAY seconds
+later on a background thread, so a burst of admin edits produces one
+publish (per worker, unless the cache is shared). Bulk jobs that skip
+signals are picked up by the publish_catalog cron job.
+
+The manifest is swapped while holding a JobCursor row lock, and a publish
+whose build started before the one already in the manifest leaves it
+alone, so overlapping publishes can't go backwards or leave two manifests.
+
+The files are served as they are for as long as they are cached, so they
+need media URLs that don't expire: publishing refuses to run with
+MEDIA_PUBLIC_URLS off.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import snapshots
+from .models import Category, Collection, JobCursor, Product
+from .serializers import CategorySerializer, CollectionSerializer
+
+logger = logging.getLogger(__name__)
+
+LOCK = 'catalog-publish'
+SCHEDULED_KEY = 'catalog-publish:scheduled'
+
+
+def build():
+    """{file name: data} for everything the storefront reads."""
+    products = snapshots.load(Product.objects.order_by('pk'))
+    for product in products:
+        # Stock moves with every checkout and doesn't trigger a publish;
+        # the storefront gets it live from the API or the cart quote.
+        del product['stock']
+    categories = CategorySerializer(Category.objects.order_by('pk'), many=True).data
+    collections = CollectionSerializer(Collection.objects.prefetch_related('products').order_by('pk'), many=True).data
+
+    files = {'products': products, 'categories': categories, 'collections': collections}
+    for category in categories:
+        files[f"category-{category['id']}"] = [p for p in products if p['category'] == category['id']]
+    by_id = {product['id']: product for product in products}
+    for collection in collections:
+        files[f"collection-{collection['id']}"] = [by_id[pk] for pk in collection['products'] if pk in by_id]
+    return files
+
+
+def publish(storage=None, keep=None, only_if_changed=False):
+    """
+    Write a new version of the catalog files and point the manifest at it.
+    Returns the manifest, or None if `only_if_changed` and the published
+    catalog is current, or another publish got there first.
+    """
+    if not settings.MEDIA_PUBLIC_URLS:
+        raise ImproperlyConfigured('Publishing the catalog needs MEDIA_PUBLIC_URLS: presigned media URLs would expire')
+    storage = storage or default_storage
+    keep = keep or settings.CATALOG_PUBLISH_KEEP
+    prefix = settings.CATALOG_PUBLISH_PREFIX
+    manifest_name = f'{prefix}/manifest.json'
+    # taken before reading the catalog, to order overlapping publishes
+    published_at = timezone.now()
+    rendered = {name: JSONRenderer().render(data) for name, data in build().items()}
+
+    digest = hashlib.sha256()
+    for name in sorted(rendered):
+        digest.update(name.encode())
+        digest.update(rendered[name])
+    digest = digest.hexdigest()
+    if only_if_changed and (read_manifest(storage) or {}).get('digest') == digest:
+        return None
+    # microseconds keep two publishes of the same content apart and in order
+    version = f"{published_at.strftime('%Y%m%d%H%M%S%f')}-{digest[:8]}"
+
+    files = {}
+    for name, content in rendered.items():
+        # mtime=0 keeps the bytes identical for identical content
+        saved = storage.save(f'{prefix}/{version}/{name}.json.gz', ContentFile(gzip.compress(content, mtime=0)))
+        files[name] = storage.url(saved)
+
+    manifest = {
+        'version': version,
+        'published_at': published_at.isoformat(),
+        'digest': digest,
+        'encoding': 'gzip',
+        'files': files,
+    }
+    with transaction.atomic():
+        JobCursor.objects.select_for_update().get_or_create(name=LOCK)
+        current = read_manifest(storage)
+        if current and current['version'] >= version:
+            # a publish that read the catalog later has already landed
+            return None
+        # storage never overwrites, so make room first; until the new
+        # manifest lands the storefront falls back to the API
+        storage.delete(manifest_name)
+        storage.save(manifest_name, ContentFile(json.dumps(manifest).encode()))
+    prune(storage, keep)
+    return manifest
+
+
+def read_manifest(storage):
+    """The published manifest, or None."""
+    try:
+        with storage.open(f'{settings.CATALOG_PUBLISH_PREFIX}/manifest.json') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def prune(storage, keep):
+    prefix = settings.CATALOG_PUBLISH_PREFIX
+    versions, _ = storage.listdir(prefix)
+    # version names start with their timestamp
+    for version in sorted(versions)[:-keep]:
+        for name in storage.listdir(f'{prefix}/{version}')[1]:
+            storage.delete(f'{prefix}/{version}/{name}')
+
+
+def publish_if_changed(storage=None):
+    """Publish unless the published catalog is current. Returns the manifest or None."""
+    return publish(storage, only_if_changed=True)
+
+
+class CatalogPublisher:
+    """
+    Debounces catalog publishes: the first change schedules one publish
+    `delay` seconds later on a background thread and later changes join it.
+    The cache flag keeps other workers from scheduling their own.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._timer is not None or not cache.add(SCHEDULED_KEY, 1, self.delay):
+                return
+            self._timer = threading.Timer(self.delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        try:
+            publish_if_changed()
+        except Exception:
+            logger.exception('Publishing the catalog failed')
+        finally:
+            connection.close()
+
+
+publisher = CatalogPublisher(settings.CATALOG_PUBLISH_DELAY)
@@ -0,0 +1,70 @@
+"""
+Rate limits and lockout for the password endpoints.
+
+login and register each run a deliberately slow password hash, so a burst
+of credential stuffing can tie up every worker. Both are rate limited per
+client IP (django-ratelimit), and login also locks a username out after
+LOGIN_LOCKOUT_ATTEMPTS failures within LOGIN_LOCKOUT_MINUTES. All the
+counters live in the cache, and every check happens before any hashing or
+database work.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def login_rate(group, request):
+    return settings.LOGIN_RATE_LIMIT
+
+
+def register_rate(group, request):
+    return settings.REGISTER_RATE_LIMIT
+
+
+def forwarded_ip(request):
+    """
+    Client address behind TRUSTED_PROXY_COUNT reverse proxies, for
+    RATELIMIT_IP_META_KEY. Each proxy appends the address it saw to
+    X-Forwarded-For, so the entry added by the outermost one is the last
+    the client can't forge; anything before it may be made up. Without
+    enough entries the request didn't come through the proxies, and the
+    connection's own address is used.
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META['REMOTE_ADDR']
+
+
+def too_many_requests(retry_after=60):
+    response = Response(
+        {'error': 'Too many attempts, please try again later'}, status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _lockout_key(username):
+    return f'login-failures:{username.strip().lower()}'
+
+
+def is_locked_out(username):
+    return bool(username) and cache.get(_lockout_key(username), 0) >= settings.LOGIN_LOCKOUT_ATTEMPTS
+
+
+def record_failure(username):
+    if not username:
+        return
+    key = _lockout_key(username)
+    # the window starts at the first failure and isn't extended by later ones
+    cache.add(key, 0, settings.LOGIN_LOCKOUT_MINUTES * 60)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, settings.LOGIN_LOCKOUT_MINUTES * 60)
+
+
+def clear_failures(username):
+    cache.delete(_lockout_key(username))
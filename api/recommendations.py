@@ -0,0 +1,245 @@
+"""
+"Frequently bought together" recommendations.
+
+Co-purchase counts are computed with NumPy from (order, product) pairs:
+every ordered pair of distinct products in the same order is encoded as a
+single int64 and counted with np.unique, which gives the sparse product x
+product co-occurrence matrix in coordinate form. Only the top
+RECOMMENDATION_COUNT neighbours of each product are stored
+(ProductRecommendation), so serving them is one indexed lookup.
+
+rebuild() recomputes everything, archived orders included. refresh() folds in orders placed since the
+last run by adding their pair counts to the stored scores and trimming each
+touched product back to its top K. Pairs outside a product's stored top K
+lose their earlier counts that way, which the nightly rebuild corrects.
+
+Both write while holding the JobCursor row, and refresh() gives up if the
+cursor moved while it was counting, so a refresh that overlaps a rebuild
+never adds its orders a second time.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import ArchivedOrder, JobCursor, Order, OrderItem, Product, ProductRecommendation
+
+CURSOR = 'recommendations'
+
+# Orders with more distinct products than this are wholesale or test orders;
+# they say little about what goes together and cost O(n^2) pairs.
+MAX_ORDER_PRODUCTS = 50
+
+# Orders younger than this may still be getting their items saved
+SETTLE_TIME = timedelta(minutes=2)
+
+ORDER_CHUNK_SIZE = 20000
+UPSERT_BATCH_SIZE = 500
+
+EMPTY = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64))
+
+
+def co_purchase_counts(order_ids, product_ids):
+    """
+    Count how often each pair of products was bought together.
+
+    Takes parallel arrays of order and product ids (one entry per order
+    line) and returns (product, related, count) arrays with both directions
+    of every pair.
+    """
+    if len(order_ids) == 0:
+        return EMPTY
+    lines = np.unique(np.column_stack([order_ids, product_ids]).astype(np.int64), axis=0)
+    orders, products = lines[:, 0], lines[:, 1]
+
+    _, starts, sizes = np.unique(orders, return_index=True, return_counts=True)
+    keep = (sizes > 1) & (sizes <= MAX_ORDER_PRODUCTS)
+    starts, sizes = starts[keep], sizes[keep]
+    if len(sizes) == 0:
+        return EMPTY
+
+    # Enumerate every (i, j) position pair inside each order without a
+    # Python loop: order k contributes sizes[k] ** 2 cells.
+    cells = sizes * sizes
+    order_of = np.repeat(np.arange(len(sizes)), cells)
+    offset = np.arange(cells.sum()) - np.repeat(np.cumsum(cells) - cells, cells)
+    n = sizes[order_of]
+    i = starts[order_of] + offset // n
+    j = starts[order_of] + offset % n
+    distinct = i != j
+    return _count(products[i[distinct]], products[j[distinct]], np.ones(distinct.sum(), np.int64))
+
+
+def _count(products, related, weights):
+    if len(products) == 0:
+        return EMPTY
+    span = int(max(products.max(), related.max())) + 1
+    codes, inverse = np.unique(products * span + related, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(codes)).astype(np.int64)
+    return codes // span, codes % span, counts
+
+
+def merge(*parts):
+    """Sum several (product, related, count) results."""
+    return _count(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+
+def _rank(products, related, scores):
+    """Sort by product, best score first, and number each product's rows from 0."""
+    order = np.lexsort((related, -scores, products))
+    products = products[order]
+    firsts, first_index = np.unique(products, return_index=True)
+    return order, np.arange(len(products)) - first_index[np.searchsorted(firsts, products)]
+
+
+def top_k(products, related, scores, k):
+    """Keep the k highest scores per product (ties broken by related id)."""
+    if len(products) == 0:
+        return EMPTY
+    order, rank = _rank(products, related, scores)
+    keep = order[rank < k]
+    return products[keep], related[keep], scores[keep]
+
+
+def _settled_order_id():
+    cutoff = timezone.now() - SETTLE_TIME
+    return Order.objects.filter(created_at__lte=cutoff).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _counts_for_orders(first_id, last_id, chunk_size, log, archived=False):
+    counts = EMPTY
+    for start in range(first_id, last_id + 1, chunk_size):
+        end = min(start + chunk_size - 1, last_id)
+        lines = np.array(
+            OrderItem.objects.filter(order__id__range=(start, end), product__isnull=False)
+            .exclude(order__status='cancelled')
+            .values_list('order_id', 'product_id'),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        counts = merge(counts, co_purchase_counts(lines[:, 0], lines[:, 1]))
+        log(f'orders {start}-{end}: {len(lines)} lines, {len(counts[0])} pairs so far')
+    if archived:
+        counts = merge(counts, _archived_counts(chunk_size, log))
+    return _existing_products(*counts)
+
+
+def _archived_counts(chunk_size, log):
+    """Co-purchase counts of archived orders, which left the live tables."""
+    counts = EMPTY
+    archived = ArchivedOrder.objects.exclude(status='cancelled').order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(archived.filter(id__gt=last_id).values_list('id', 'data')[:chunk_size])
+        if not chunk:
+            return counts
+        lines = np.array(
+            [
+                (order_id, item['product_id'])
+                for order_id, data in chunk
+                for item in data['items'] if item['product_id'] is not None
+            ],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        counts = merge(counts, co_purchase_counts(lines[:, 0], lines[:, 1]))
+        last_id = chunk[-1][0]
+        log(f'archived orders up to {last_id}: {len(lines)} lines, {len(counts[0])} pairs so far')
+
+
+def _existing_products(products, related, counts):
+    # Products deleted since the orders were placed
+    known = np.fromiter(Product.objects.values_list('id', flat=True), dtype=np.int64)
+    keep = np.isin(products, known) & np.isin(related, known)
+    return products[keep], related[keep], counts[keep]
+
+
+def _lock_cursor():
+    return JobCursor.objects.select_for_update().filter(name=CURSOR).first()
+
+
+def _save_cursor(position):
+    JobCursor.objects.update_or_create(name=CURSOR, defaults={'position': position})
+
+
+def rebuild(k=None, chunk_size=ORDER_CHUNK_SIZE, log=print):
+    """Recompute all recommendations from order history."""
+    k = k or settings.RECOMMENDATION_COUNT
+    last_id = _settled_order_id()
+    products, related, scores = top_k(*_counts_for_orders(1, last_id, chunk_size, log, archived=True), k)
+
+    with transaction.atomic():
+        _lock_cursor()
+        ProductRecommendation.objects.all().delete()
+        ProductRecommendation.objects.bulk_create(
+            [
+                ProductRecommendation(product_id=int(p), related_id=int(r), score=int(s))
+                for p, r, s in zip(products, related, scores)
+            ],
+            batch_size=1000,
+        )
+        _save_cursor(last_id)
+    bump_version('catalog')
+    return len(products)
+
+
+def refresh(k=None, chunk_size=ORDER_CHUNK_SIZE, log=print):
+    """
+    Add orders placed since the last run. Falls back to a full rebuild the
+    first time. Returns the number of products whose recommendations changed.
+    """
+    k = k or settings.RECOMMENDATION_COUNT
+    cursor = JobCursor.objects.filter(name=CURSOR).first()
+    if cursor is None:
+        rebuild(k, chunk_size, log)
+        return ProductRecommendation.objects.values('product_id').distinct().count()
+
+    last_id = _settled_order_id()
+    if last_id <= cursor.position:
+        return 0
+    products, related, counts = _counts_for_orders(cursor.position + 1, last_id, chunk_size, log)
+
+    with transaction.atomic():
+        if _lock_cursor().position != cursor.position:
+            # another run folded in these orders meanwhile
+            return 0
+        for start in range(0, len(products), UPSERT_BATCH_SIZE):
+            batch = slice(start, start + UPSERT_BATCH_SIZE)
+            _add_scores(products[batch], related[batch], counts[batch])
+        touched = np.unique(products)
+        _trim(touched, k)
+        _save_cursor(last_id)
+    if len(touched):
+        bump_version('catalog')
+    return len(touched)
+
+
+def _add_scores(products, related, counts):
+    if len(products) == 0:
+        return
+    table = connection.ops.quote_name(ProductRecommendation._meta.db_table)
+    placeholders = ', '.join(['(%s, %s, %s)'] * len(products))
+    params = []
+    for row in zip(products, related, counts):
+        params.extend(int(value) for value in row)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (product_id, related_id, score) VALUES {placeholders} '
+            f'ON CONFLICT (product_id, related_id) DO UPDATE SET score = {table}.score + excluded.score',
+            params,
+        )
+
+
+def _trim(product_ids, k):
+    if len(product_ids) == 0:
+        return
+    rows = np.array(
+        ProductRecommendation.objects.filter(product_id__in=product_ids.tolist())
+        .values_list('id', 'product_id', 'related_id', 'score'),
+        dtype=np.int64,
+    ).reshape(-1, 4)
+    order, rank = _rank(rows[:, 1], rows[:, 2], rows[:, 3])
+    drop = rows[order[rank >= k], 0]
+    if len(drop):
+        ProductRecommendation.objects.filter(id__in=drop.tolist()).delete()
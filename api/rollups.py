@@ -0,0 +1,233 @@
+"""
+Incrementally maintained sales rollups (see SalesRollup).
+
+Every change is a single INSERT ... ON CONFLICT DO UPDATE that adds deltas
+to the affected rows, so recording an order costs one statement no matter
+how many lines it has, and concurrent checkouts never read-modify-write the
+same row. Works on PostgreSQL and SQLite.
+
+Orders are created through checkout, the orders API or the admin, which
+all call record_order(); changes to an order's status, total or currency
+made with save() are followed by a post_save signal (update_order()).
+Anything that changes orders with queryset.update() or deletes them has to
+adjust the rollups itself (move_orders(), remove_orders(), see
+api.lifecycle). rebuild() repairs drift; it is a maintenance job, as
+checkouts wait while it runs.
+"""
+import copy
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderItem, SalesRollup
+
+ORDER_TOTALS = 0
+
+# Rows per upsert statement, well under SQLite's and PostgreSQL's parameter limits
+DELTA_BATCH_SIZE = 500
+
+# Statuses that count as revenue in the analytics endpoint by default
+REVENUE_STATUSES = ['paid', 'shipped', 'delivered']
+
+
+def _order_rows(order, items):
+    units = sum(item.quantity for item in items)
+    rows = {ORDER_TOTALS: [Decimal(order.total), 1, units]}
+    for item in items:
+        if item.product_id is None:
+            continue
+        row = rows.setdefault(item.product_id, [Decimal('0'), 1, 0])
+        row[0] += item.price * item.quantity
+        row[2] += item.quantity
+    return rows
+
+
+def apply_deltas(deltas):
+    """
+    Add deltas to rollup rows, one upsert per DELTA_BATCH_SIZE rows.
+    deltas: iterable of (day, product_id, currency, status, revenue, order_count, units)
+    """
+    # PostgreSQL refuses an upsert that touches the same row twice, so
+    # deltas for the same row (several orders from one day) are summed first.
+    merged = {}
+    for day, product_id, currency, status, revenue, order_count, units in deltas:
+        row = merged.setdefault((day, product_id, currency, status), [0, 0, 0])
+        row[0] += revenue
+        row[1] += order_count
+        row[2] += units
+    deltas = [(*key, *row) for key, row in merged.items()]
+    for start in range(0, len(deltas), DELTA_BATCH_SIZE):
+        _upsert(deltas[start:start + DELTA_BATCH_SIZE])
+
+
+def _upsert(deltas):
+    table = connection.ops.quote_name(SalesRollup._meta.db_table)
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(deltas))
+    sql = (
+        f'INSERT INTO {table} (day, product_id, currency, status, revenue, order_count, units) '
+        f'VALUES {placeholders} '
+        f'ON CONFLICT (day, product_id, currency, status) DO UPDATE SET '
+        f'revenue = {table}.revenue + excluded.revenue, '
+        f'order_count = {table}.order_count + excluded.order_count, '
+        f'units = {table}.units + excluded.units'
+    )
+    params = []
+    for day, product_id, currency, status, revenue, order_count, units in deltas:
+        params.extend([str(day), product_id, currency, status, str(revenue), order_count, units])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _deltas(order, items, status, sign):
+    day = timezone.localdate(order.created_at)
+    for product_id, (revenue, order_count, units) in _order_rows(order, items).items():
+        yield day, product_id, order.currency, status, revenue * sign, order_count * sign, units * sign
+
+
+def record_order(order, items=None):
+    """Add a newly created order (with its items saved) to the rollups."""
+    items = list(order.items.all()) if items is None else items
+    apply_deltas(_deltas(order, items, order.status, 1))
+    order._loaded_status, order._loaded_total, order._loaded_currency = order.status, order.total, order.currency
+
+
+def update_order(order, old_status, old_total, old_currency):
+    """Move an order's contribution from what it was recorded as to what it is now."""
+    items = list(order.items.all())
+    old = copy.copy(order)
+    old.total, old.currency = old_total, old_currency
+    apply_deltas([*_deltas(old, items, old_status, -1), *_deltas(order, items, order.status, 1)])
+    order._loaded_status, order._loaded_total, order._loaded_currency = order.status, order.total, order.currency
+
+
+def move_orders(orders, old_status, new_status):
+    """move_order for many orders in one upsert; prefetch their items."""
+    deltas = []
+    for order in orders:
+        items = list(order.items.all())
+        deltas += _deltas(order, items, old_status, -1)
+        deltas += _deltas(order, items, new_status, 1)
+    apply_deltas(deltas)
+
+
+def remove_orders(orders):
+    """Take orders that are about to be deleted out of the rollups; prefetch their items."""
+    deltas = []
+    for order in orders:
+        deltas += _deltas(order, list(order.items.all()), order.status, -1)
+    apply_deltas(deltas)
+
+
+def rebuild(chunk_size=5000, log=print):
+    """
+    Recompute all rollups from Order/OrderItem, aggregating one chunk of
+    order ids at a time in the database, plus the archived orders (which
+    are gone from the live tables but still count), in one transaction.
+
+    The rollup table is locked for the whole rebuild, and every checkout
+    writes to it, so checkouts wait until it is done: run it in a quiet
+    window. Orders created after it starts are left to the live increments.
+    """
+    last_id = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Live increments wait until the rebuilt rows are committed
+            # instead of landing on rows that are about to be replaced.
+            # (SQLite already allows one writer at a time.)
+            table = connection.ops.quote_name(SalesRollup._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+        SalesRollup.objects.all().delete()
+
+        for start in range(1, last_id + 1, chunk_size):
+            end = min(start + chunk_size - 1, last_id)
+            orders = (
+                Order.objects.filter(id__range=(start, end))
+                .annotate(day=TruncDate('created_at'))
+                .values('day', 'currency', 'status')
+                .annotate(revenue=Sum('total'), orders=Count('id'))
+            )
+            items = (
+                OrderItem.objects.filter(order__id__range=(start, end))
+                .annotate(day=TruncDate('order__created_at'), currency=F('order__currency'), status=F('order__status'))
+            )
+            order_units = {
+                (row['day'], row['currency'], row['status']): row['units']
+                for row in items.values('day', 'currency', 'status').annotate(units=Sum('quantity'))
+            }
+            product_rows = (
+                items.filter(product_id__isnull=False)
+                .values('day', 'currency', 'status', 'product_id')
+                .annotate(
+                    revenue=Sum(F('price') * F('quantity')),
+                    orders=Count('order_id', distinct=True),
+                    units=Sum('quantity'),
+                )
+            )
+
+            deltas = [
+                (row['day'], ORDER_TOTALS, row['currency'], row['status'], row['revenue'], row['orders'],
+                 order_units.get((row['day'], row['currency'], row['status']), 0))
+                for row in orders
+            ]
+            deltas += [
+                (row['day'], row['product_id'], row['currency'], row['status'], row['revenue'], row['orders'], row['units'])
+                for row in product_rows
+            ]
+            apply_deltas(deltas)
+            log(f'orders {start}-{end}: {len(deltas)} rollup rows')
+
+        _add_archived(chunk_size, log)
+
+
+def _add_archived(chunk_size, log):
+    archived = ArchivedOrder.objects.order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(archived.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        deltas = []
+        for archived_order in chunk:
+            order = archived_order.restore()
+            deltas += _deltas(order, list(order.items.all()), order.status, 1)
+        apply_deltas(deltas)
+        last_id = chunk[-1].id
+        log(f'archived orders up to {last_id}: {len(deltas)} rollup deltas')
+
+
+GROUP_FIELDS = {'day': 'day', 'product': 'product_id', 'status': 'status'}
+
+
+def query(start, end, statuses=None, currency=None, product_id=None, group_by=None, limit=None):
+    """
+    Sum the rollups over a date range. Cost depends on the number of days
+    (and products) in the range, not on how many orders there are. Revenue
+    is always split by currency.
+    """
+    rollups = SalesRollup.objects.filter(day__range=(start, end), status__in=statuses or REVENUE_STATUSES)
+    if currency:
+        rollups = rollups.filter(currency=currency.upper())
+    if product_id is not None:
+        rollups = rollups.filter(product_id=product_id)
+    elif group_by == 'product':
+        rollups = rollups.exclude(product_id=ORDER_TOTALS)
+    else:
+        rollups = rollups.filter(product_id=ORDER_TOTALS)
+
+    fields = ['currency']
+    if group_by:
+        fields.insert(0, GROUP_FIELDS[group_by])
+    rows = rollups.values(*fields).annotate(
+        revenue=Sum('revenue'), orders=Sum('order_count'), units=Sum('units')
+    )
+    if group_by == 'product':
+        rows = rows.order_by('-revenue')
+    else:
+        rows = rows.order_by(*fields)
+    if limit:
+        rows = rows[:limit]
+    return list(rows)
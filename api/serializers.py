@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from .models import Product, ProductImage, Collection, Order, OrderItem, Category
+from .models import Product, ProductImage, Collection, Order, OrderItem, Category, VideoUpload
 from django.contrib.auth.models import User
+from .rollups import record_order
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -36,9 +37,11 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = [
             'id', 'name', 'category', 'category_name', 'price', 'description', 'details', 
-            'image', 'video', 'delivery_charges', 'featured', 'bestseller', 
+            'image', 'video', 'delivery_charges', 'featured', 'bestseller', 'stock',
             'images', 'uploaded_images', 'created_at'
         ]
+        # changed only through /api/products/{id}/restock/ (api.inventory)
+        read_only_fields = ['stock']
 
     def get_category_name(self, obj):
         try:
@@ -86,6 +89,10 @@ class CollectionSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(str(e))
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    # a plain id: OrderSerializer.create() checks all of an order's products
+    # in one query instead of one per line
+    product = serializers.IntegerField(source='product_id', allow_null=True, required=False)
+
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'name', 'price', 'quantity', 'image_url']
@@ -103,11 +110,33 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
+        product_ids = {item['product_id'] for item in items_data if item.get('product_id') is not None}
+        missing = product_ids - set(Product.objects.only('pk').in_bulk(product_ids))
+        if missing:
+            raise serializers.ValidationError(
+                {'items': [f"Products not found: {', '.join(str(pk) for pk in sorted(missing))}"]}
+            )
         order = Order.objects.create(**validated_data)
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
+        items = OrderItem.objects.bulk_create([OrderItem(order=order, **item_data) for item_data in items_data])
+        record_order(order, items)
         return order
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    # What the order confirmation page shows; no address or phone
+    items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'first_name', 'email', 'currency', 'total', 'shipping',
+            'status', 'created_at', 'items'
+        ]
+
+class VideoUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VideoUpload
+        fields = ['id', 'product', 'filename', 'size', 'received', 'status', 'created_at', 'updated_at']
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -0,0 +1,106 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.authentication import forget_user
+
+from . import currency, inventory, rollups, snapshots
+from .caching import bump_version
+from .models import Category, Collection, CurrencyRate, Order, Product, ProductImage, StockReservation
+from .publisher import publisher
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver(m2m_changed, sender=Collection.products.through)
+def invalidate_catalog(sender, **kwargs):
+    # Anything cached from catalog data embeds the 'catalog' version.
+    # Bulk writes skip signals and must bump it themselves.
+    bump_version('catalog')
+    if settings.CATALOG_PUBLISH:
+        transaction.on_commit(publisher.schedule)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_snapshot(sender, instance, raw=False, **kwargs):
+    if not raw:
+        snapshots.refresh([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def refresh_gallery_snapshot(sender, instance, raw=False, **kwargs):
+    # Deleting a product deletes its snapshot and then its images, and the
+    # product row goes last; refreshing right away would write a snapshot
+    # for a product that is about to disappear. After the commit refresh()
+    # no longer finds it.
+    if not raw:
+        product_id = instance.product_id
+        transaction.on_commit(lambda: snapshots.refresh([product_id]))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    # Deleting a category nulls its products' category with an UPDATE, so
+    # they can't be found by category afterwards.
+    instance._product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def refresh_category_snapshots(sender, instance, created=False, raw=False, **kwargs):
+    # Products show their category's name
+    if created or raw:
+        return
+    product_ids = getattr(instance, '_product_ids', None)
+    snapshots.refresh(product_ids if product_ids is not None else instance.products.all())
+
+
+@receiver([post_save, post_delete], sender=CurrencyRate)
+def invalidate_currency_rates(sender, **kwargs):
+    currency.invalidate()
+
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups(sender, instance, created, **kwargs):
+    # New orders are recorded explicitly once their items exist
+    # (rollups.record_order); here we only follow changes to the status,
+    # total or currency (an admin correcting an order).
+    old_status = getattr(instance, '_loaded_status', None)
+    if created or old_status is None:
+        return
+    old_total = getattr(instance, '_loaded_total', None)
+    old_total = instance.total if old_total is None else old_total
+    old_currency = getattr(instance, '_loaded_currency', None) or instance.currency
+    if (old_status, Decimal(str(old_total)), old_currency) == (instance.status, Decimal(str(instance.total)), instance.currency):
+        return
+    rollups.update_order(instance, old_status, old_total, old_currency)
+    if old_status != instance.status:
+        settle_stock(instance)
+
+
+@receiver(pre_delete, sender=Order)
+def release_deleted_order_stock(sender, instance, **kwargs):
+    # The reservations would go with the order (CASCADE) without putting
+    # their stock back. Only pending orders still hold any.
+    if instance.status == 'pending':
+        inventory.release(StockReservation.objects.filter(order=instance))
+
+
+def settle_stock(order):
+    # Reserved stock goes back on the shelf when an order is cancelled and
+    # is sold for good once it's paid.
+    if order.status == 'cancelled':
+        inventory.release(StockReservation.objects.filter(order=order))
+    elif order.status in rollups.REVENUE_STATUSES:
+        inventory.confirm(order)
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # Token authentication caches users (core.authentication)
+    forget_user(instance.pk)
@@ -0,0 +1,116 @@
+"""
+Precomputed product JSON for the catalog read path.
+
+Running ProductSerializer costs a few dozen field objects per product on
+every request. Instead each product's serialized form is stored in
+ProductSnapshot and refreshed when the product, its images or its category
+are saved (api.signals) or flagged in bulk (api.bestsellers). Product list
+and detail responses are then one query that joins the snapshots to the
+live `stock` column: stock moves with every checkout through update(),
+which skips signals, so it is never taken from the snapshot. Media fields
+are stored as storage names and turned into URLs on read, so presigned
+URLs (MEDIA_PUBLIC_URLS off) are signed fresh for every response instead
+of expiring inside the snapshot.
+
+Products without a snapshot yet (bulk-created ones, or any created before
+snapshots existed) are rendered and saved the first time they are read;
+rebuild_product_snapshots renders everything in parallel batches.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import QuerySet
+
+from .models import Product, ProductSnapshot
+from .serializers import ProductSerializer
+
+BATCH_SIZE = 500
+
+
+def save(products):
+    """Render and store snapshots for `products` (a queryset). Returns them."""
+    products = list(products.select_related('category').prefetch_related('images'))
+    # one many=True serializer builds its fields once, not once per product
+    rendered = ProductSerializer(products, many=True).data
+    for product, data in zip(products, rendered):
+        media_names(product, data)
+    snapshots = [ProductSnapshot(product=product, data=data) for product, data in zip(products, rendered)]
+    ProductSnapshot.objects.bulk_create(
+        snapshots, batch_size=BATCH_SIZE,
+        update_conflicts=True, unique_fields=['product'], update_fields=['data', 'updated_at'],
+    )
+    return snapshots
+
+
+def refresh(products):
+    """Re-render the snapshots of a product queryset or list of product ids."""
+    if not isinstance(products, QuerySet):
+        products = Product.objects.filter(pk__in=list(products))
+    return len(save(products))
+
+
+def load(products, request=None):
+    """
+    Rendered products for a product queryset, in its order, with live stock
+    and media URLs. With a request, local media URLs are made absolute the
+    way the serializer would.
+    """
+    rows = list(products.values_list('pk', 'stock', 'snapshot__data'))
+    missing = [pk for pk, _, data in rows if data is None]
+    built = {}
+    if missing:
+        built = {snapshot.product_id: snapshot.data for snapshot in save(Product.objects.filter(pk__in=missing))}
+
+    result = []
+    for pk, stock, data in rows:
+        data = data if data is not None else built.get(pk)
+        if data is None:
+            # deleted while we were reading
+            continue
+        data['stock'] = stock
+        result.append(data)
+    media_urls(result, request)
+    return result
+
+
+def media_names(product, data):
+    """Replace the media URLs in a product's rendered `data` with storage names."""
+    data['image'] = product.image.name or None
+    data['video'] = product.video.name or None
+    # the serializer rendered the same prefetched images, in the same order
+    for item, image in zip(data['images'], product.images.all()):
+        item['image'] = image.image.name or None
+
+
+def media_urls(rows, request=None):
+    absolute = request is not None and not urlsplit(settings.MEDIA_URL).netloc
+    for row in rows:
+        for item in [row, *row['images']]:
+            for field in ('image', 'video'):
+                if item.get(field):
+                    url = default_storage.url(item[field])
+                    item[field] = request.build_absolute_uri(url) if absolute else url
+
+
+def rebuild(batch_size=BATCH_SIZE, workers=1, log=print):
+    """Re-render every product's snapshot, `workers` batches at a time. Returns how many."""
+    ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+    done = 0
+    if workers > 1 and len(batches) > 1:
+        # Forked workers must open their own connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            for count in pool.map(refresh, batches):
+                done += count
+                log(f'{done}/{len(ids)} products')
+    else:
+        for batch in batches:
+            done += refresh(batch)
+            log(f'{done}/{len(ids)} products')
+    return done
@@ -0,0 +1,198 @@
+"""
+Resumable, chunked uploads of product videos.
+
+An admin client starts an upload with the file's name and size, then PUTs
+the bytes in chunks of at most UPLOAD_CHUNK_SIZE, each with a
+`Content-Range: bytes first-last/size` header. A chunk is copied from the
+request to a part file in UPLOAD_TEMP_DIR a block at a time, so memory use
+stays flat whatever the file size, and `received` only moves forward with a
+conditional UPDATE once the bytes are on disk. After a dropped connection
+the client GETs the upload and carries on from `received`.
+
+When the last byte arrives the part file is saved to Product.video through
+the default storage (which streams it, in multipart pieces on S3), the
+product's previous video is deleted and the part file removed. Whoever
+does the copy first moves the upload to `finishing` with a conditional
+UPDATE, so a resent last chunk or the clean-up job arriving meanwhile
+leaves it to them. The copy can fail or be cut off by the worker timeout on
+a large file. A failed copy puts the upload back to `uploading` with every
+byte received, and any further PUT to it retries the copy.
+clear_stale_uploads retries uploads left `uploading` or `finishing` for
+FINISH_RETRY_AFTER. Uploads left unfinished for UPLOAD_EXPIRY_HOURS are
+cleared by clear_stale_uploads.
+"""
+import logging
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+
+from .models import VideoUpload
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+BLOCK_SIZE = 64 * 1024
+
+# Longer than any request may run, so the job never races a request that
+# is still copying the file
+FINISH_RETRY_AFTER = timedelta(minutes=10)
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkTooLarge(UploadError):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, received):
+        # where the next chunk has to start
+        self.received = received
+        super().__init__(f'The next chunk must start at byte {received}')
+
+
+def part_path(upload):
+    return os.path.join(settings.UPLOAD_TEMP_DIR, f'{upload.pk}.part')
+
+
+def start(product, filename, size):
+    filename = os.path.basename(filename or '')
+    if not filename:
+        raise UploadError('filename is required')
+    if size <= 0 or size > settings.VIDEO_UPLOAD_MAX_SIZE:
+        raise UploadError(f'size must be between 1 and {settings.VIDEO_UPLOAD_MAX_SIZE} bytes')
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    upload = VideoUpload.objects.create(product=product, filename=filename, size=size)
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def parse_content_range(header, size):
+    """(first, last) byte of a chunk from its Content-Range header."""
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+    if not match:
+        raise UploadError('Content-Range must look like "bytes first-last/size"')
+    first, last, total = (int(value) for value in match.groups())
+    if total != size or first > last or last >= size:
+        raise UploadError(f'Content-Range does not fit an upload of {size} bytes')
+    if last - first + 1 > settings.UPLOAD_CHUNK_SIZE:
+        raise ChunkTooLarge(f'Chunks may be at most {settings.UPLOAD_CHUNK_SIZE} bytes')
+    return first, last
+
+
+def append(upload, content_range, stream):
+    """
+    Write the chunk read from `stream` and record it. Returns the upload,
+    with the video attached to its product if this was the last chunk.
+    """
+    if upload.status != 'uploading':
+        # complete, or being attached by another request
+        return upload
+    if upload.received == upload.size:
+        # Every byte is here but attaching the file failed last time
+        finish(upload)
+        return upload
+    first, last = parse_content_range(content_range, upload.size)
+    if first != upload.received:
+        raise OffsetMismatch(upload.received)
+
+    length = last - first + 1
+    with open(part_path(upload), 'r+b') as part:
+        part.seek(first)
+        remaining = length
+        while remaining:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            part.write(block)
+            remaining -= len(block)
+    if remaining:
+        # the client went away mid-chunk; it can send the chunk again
+        raise UploadError(f'Expected {length} bytes but the chunk ended after {length - remaining}')
+
+    # Another request may have sent the same chunk meanwhile; only one moves
+    # the offset on.
+    updated = VideoUpload.objects.filter(pk=upload.pk, status='uploading', received=first).update(
+        received=last + 1, updated_at=timezone.now()
+    )
+    upload.refresh_from_db()
+    if not updated:
+        raise OffsetMismatch(upload.received)
+    if upload.received == upload.size:
+        finish(upload)
+    return upload
+
+
+def finish(upload, retry_before=None):
+    """
+    Attach the assembled file to the product, replacing (and deleting) its
+    previous video, and drop the part file. Returns False, with `upload`
+    refreshed, if it is complete or another request is attaching it.
+
+    With `retry_before`, an upload stuck `finishing` since before then (its
+    request died mid-copy) is taken over too.
+    """
+    claim = VideoUpload.objects.filter(pk=upload.pk)
+    if retry_before is None:
+        claim = claim.filter(status='uploading')
+    else:
+        claim = claim.filter(status__in=['uploading', 'finishing'], updated_at__lt=retry_before)
+    if not claim.update(status='finishing', updated_at=timezone.now()):
+        upload.refresh_from_db()
+        return False
+    upload.status = 'finishing'
+
+    product = upload.product
+    previous = product.video.name
+    path = part_path(upload)
+    try:
+        with open(path, 'rb') as part:
+            product.video.save(upload.filename, File(part), save=False)
+    except Exception:
+        VideoUpload.objects.filter(pk=upload.pk, status='finishing').update(status='uploading')
+        upload.status = 'uploading'
+        raise
+    product.save(update_fields=['video'])
+    upload.status = 'complete'
+    upload.save(update_fields=['status', 'updated_at'])
+    os.remove(path)
+    if previous and previous != product.video.name:
+        product.video.storage.delete(previous)
+    return True
+
+
+def finish_pending():
+    """Retry finish() for uploads left with every byte received. Returns how many were attached."""
+    retry_before = timezone.now() - FINISH_RETRY_AFTER
+    pending = VideoUpload.objects.filter(
+        status__in=['uploading', 'finishing'], received=F('size'), updated_at__lt=retry_before
+    ).select_related('product')
+    count = 0
+    for upload in pending:
+        try:
+            count += finish(upload, retry_before=retry_before)
+        except Exception:
+            logger.exception('Attaching video upload %s failed', upload.pk)
+    return count
+
+
+def clear_stale(hours=None):
+    """Delete uploads untouched for `hours`, with their part files. Returns how many."""
+    hours = settings.UPLOAD_EXPIRY_HOURS if hours is None else hours
+    stale = VideoUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(hours=hours))
+    count = 0
+    for upload in stale.iterator():
+        try:
+            os.remove(part_path(upload))
+        except FileNotFoundError:
+            pass
+        upload.delete()
+        count += 1
+    return count
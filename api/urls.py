@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     ProductViewSet, CollectionViewSet, OrderViewSet, CategoryViewSet,
-    LoginView, LogoutView, CurrentUserView, RegisterView,
-    create_checkout_session, keep_alive, stripe_webhook
+    LoginView, LogoutView, CurrentUserView, RegisterView, MetricsView, SalesAnalyticsView,
+    cart_quote, create_checkout_session, keep_alive, stripe_webhook, video_upload_view
 )
 
 router = DefaultRouter()
@@ -17,8 +18,13 @@ urlpatterns = [
     path('register/', RegisterView, name='register'),
     path('login/', LoginView, name='login'),
     path('logout/', LogoutView, name='logout'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('me/', CurrentUserView, name='me'),
     path('keep-alive/', keep_alive, name='keep-alive'),
+    path('metrics/', MetricsView, name='metrics'),
+    path('analytics/sales/', SalesAnalyticsView, name='sales-analytics'),
+    path('cart/quote/', cart_quote, name='cart-quote'),
+    path('uploads/<uuid:upload_id>/', video_upload_view, name='video-upload'),
     path('payments/create-checkout-session/', create_checkout_session, name='create-checkout-session'),
     path('payments/webhook/', stripe_webhook, name='stripe-webhook'),
 ]
@@ -1,28 +1,59 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes, authentication_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import RefreshToken
+from django_ratelimit.decorators import ratelimit
 from django.contrib.auth import authenticate, login, logout
-from django.db import connection
-from django.db.utils import DatabaseError
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db.models import Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_safe
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .models import Product, Collection, Order, OrderItem, Category
+from .models import (
+    Product, Collection, Order, OrderItem, Category, ProductRecommendation, StockReservation,
+    VideoUpload,
+)
 from .serializers import (
-    ProductSerializer, CollectionSerializer, OrderSerializer, 
-    UserSerializer, RegisterSerializer, CategorySerializer
+    ProductSerializer, CollectionSerializer, OrderSerializer, OrderSummarySerializer,
+    UserSerializer, RegisterSerializer, CategorySerializer, VideoUploadSerializer
 )
 from .emails import send_order_confirmation_email
+from .caching import get_version
+from .currency import get_rate, localize_prices
+from .health import monitor
+from .pricing import QuoteError, build_quote, create_order_from_quote, load_quote, tracked_quantities
+from . import inventory, lifecycle, media, ratelimits, rollups, snapshots, uploads
+from core.authentication import CanReadMetrics, MetricsTokenAuthentication
+from core.metrics import registry, track_external
 import stripe
 from django.conf import settings
+from datetime import timedelta
+import copy
+import io
+import os
 from decimal import Decimal
+import logging
 
 stripe.api_key = getattr(settings, 'STRIPE_SECRET_KEY', 'your_stripe_secret_key_here')
 
+logger = logging.getLogger(__name__)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    read_from_replica = True
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -33,20 +64,162 @@ class CategoryViewSet(viewsets.ModelViewSet):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category').prefetch_related('images')
     serializer_class = ProductSerializer
+    read_from_replica = True
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'related', 'bundle']:
             permission_classes = [permissions.AllowAny]
         else:
             permission_classes = [permissions.IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def get_currency(self):
+        code = self.request.query_params.get('currency')
+        if code and get_rate(code) is None:
+            raise ValidationError({'currency': f'Unsupported currency: {code}'})
+        return code
+
+    def list(self, request, *args, **kwargs):
+        # Stored snapshots instead of ProductSerializer (see api.snapshots)
+        currency = self.get_currency()
+        rows = snapshots.load(Product.objects.order_by('pk'), request)
+        if currency:
+            localize_prices(rows, currency)
+        return Response(rows)
+
+    def retrieve(self, request, *args, **kwargs):
+        currency = self.get_currency()
+        try:
+            pk = int(kwargs['pk'])
+        except (TypeError, ValueError):
+            raise Http404
+        rows = snapshots.load(Product.objects.filter(pk=pk), request)
+        if not rows:
+            raise Http404
+        if currency:
+            localize_prices(rows, currency)
+        return Response(rows[0])
+
+    def related_products(self, pk):
+        recommendations = (
+            ProductRecommendation.objects.filter(product_id=pk)
+            .select_related('related__category')
+            .order_by('-score', 'related_id')
+        )
+        return [recommendation.related for recommendation in recommendations]
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """Products frequently bought together with this one (see api.recommendations)."""
+        currency = self.get_currency()
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise Http404
+        products = self.related_products(pk)
+        if not products and not Product.objects.filter(pk=pk).exists():
+            raise Http404
+        prefetch_related_objects(products, 'images')
+        data = self.get_serializer(products, many=True).data
+        if currency:
+            localize_prices(data, currency)
+        return Response(data)
+
+    @action(detail=True, methods=['get'])
+    def bundle(self, request, pk=None):
+        """
+        Everything the product page needs in one response: the product with
+        its gallery, its collections, other products from its category and
+        frequently-bought-together products. Built with a fixed number of
+        queries and cached under the catalog version; stock changes with
+        every checkout without bumping it, so a cached bundle gets live
+        stock from one more query.
+        """
+        currency = self.get_currency()
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise Http404
+        key = f"product-bundle:{get_version('catalog')}:{pk}"
+        data = cache.get(key)
+        if data is None:
+            data = self.build_bundle()
+            timeout = settings.PRODUCT_BUNDLE_CACHE_TIMEOUT
+            if not settings.MEDIA_PUBLIC_URLS:
+                # well inside the lifetime of the presigned media URLs
+                timeout = min(timeout, 60)
+            cache.set(key, data, timeout)
+        else:
+            rows = [data['product'], *data['siblings'], *data['related']]
+            stock = dict(Product.objects.filter(pk__in=[row['id'] for row in rows]).values_list('pk', 'stock'))
+            for row in rows:
+                row['stock'] = stock.get(row['id'], row['stock'])
+        if currency:
+            data = copy.deepcopy(data)
+            localize_prices([data['product'], *data['siblings'], *data['related']], currency)
+        return Response(data)
+
+    def build_bundle(self):
+        product = self.get_object()
+        collections = Collection.objects.filter(products=product).prefetch_related('products')
+        siblings = []
+        if product.category_id:
+            siblings = list(
+                Product.objects.filter(category_id=product.category_id).exclude(pk=product.pk)
+                .select_related('category').order_by('-created_at')[:settings.PRODUCT_BUNDLE_SIBLINGS]
+            )
+        related = self.related_products(product.pk)
+        prefetch_related_objects(siblings + related, 'images')
+        return {
+            'product': self.get_serializer(product).data,
+            'collections': CollectionSerializer(collections, many=True, context=self.get_serializer_context()).data,
+            'siblings': self.get_serializer(siblings, many=True).data,
+            'related': self.get_serializer(related, many=True).data,
+        }
+
+    @action(detail=True, methods=['post'])
+    def restock(self, request, pk=None):
+        """
+        Add `quantity` units to the product's stock (negative to remove
+        some) without disturbing reservations made meanwhile.
+        """
+        product = self.get_object()
+        try:
+            quantity = int(request.data.get('quantity'))
+        except (TypeError, ValueError):
+            return Response({'error': 'quantity must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stock = inventory.adjust(product.pk, quantity)
+        except inventory.OutOfStock as e:
+            return Response({'error': str(e), 'available': e.available}, status=status.HTTP_409_CONFLICT)
+        return Response({'id': product.pk, 'stock': stock})
+
+    @action(detail=True, methods=['post'], url_path='video-upload')
+    def video_upload(self, request, pk=None):
+        """
+        Start a resumable upload of the product's video; the bytes follow as
+        chunks PUT to /api/uploads/<id>/ (see api.uploads).
+        """
+        product = self.get_object()
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({'error': 'size must be a number of bytes'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload = uploads.start(product, request.data.get('filename'), size)
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        data = VideoUploadSerializer(upload).data
+        data['chunk_size'] = settings.UPLOAD_CHUNK_SIZE
+        return Response(data, status=status.HTTP_201_CREATED)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CollectionViewSet(viewsets.ModelViewSet):
-    queryset = Collection.objects.all()
+    queryset = Collection.objects.prefetch_related('products')
     serializer_class = CollectionSerializer
+    read_from_replica = True
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -57,11 +230,11 @@ class CollectionViewSet(viewsets.ModelViewSet):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all().order_by('-created_at')
+    queryset = Order.objects.prefetch_related('items').order_by('-created_at')
     serializer_class = OrderSerializer
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ['create', 'by_session']:
             permission_classes = [permissions.AllowAny]
         else:
             permission_classes = [permissions.IsAdminUser]
@@ -71,29 +244,79 @@ class OrderViewSet(viewsets.ModelViewSet):
         order = serializer.save()
         send_order_confirmation_email(order)
 
+    def perform_destroy(self, instance):
+        lifecycle.delete_orders(Order.objects.filter(pk=instance.pk))
+
+    def retrieve(self, request, *args, **kwargs):
+        # Old finished orders are moved to the archive (api.lifecycle)
+        order = lifecycle.get_order(self.kwargs['pk']) if str(self.kwargs['pk']).isdigit() else None
+        if order is None:
+            raise Http404
+        data = self.get_serializer(order).data
+        if getattr(order, 'archived', False):
+            data['archived'] = True
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path=r'by-session/(?P<session_id>[^/]+)')
+    def by_session(self, request, session_id=None):
+        """
+        Order summary for the confirmation page, found by the Stripe
+        Checkout Session id in its URL: one indexed query, no Stripe call.
+        """
+        items = list(
+            OrderItem.objects.select_related('order').filter(order__stripe_session_id=session_id).order_by('id')
+        )
+        if items:
+            order = items[0].order
+        else:
+            order = Order.objects.filter(stripe_session_id=session_id).first()
+            if order is None:
+                raise Http404
+        order._prefetched_objects_cache = {'items': items}
+        return Response(OrderSummarySerializer(order).data)
+
+def user_with_tokens(user):
+    # Clients send the access token as "Authorization: Bearer ..." and
+    # renew it at /api/token/refresh/ instead of re-sending the password.
+    refresh = RefreshToken.for_user(user)
+    return {**UserSerializer(user).data, 'access': str(refresh.access_token), 'refresh': str(refresh)}
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
 @authentication_classes([])
+@ratelimit(key='ip', rate=ratelimits.register_rate, group='register', block=False)
 def register_view(request):
+    if getattr(request, 'limited', False):
+        return ratelimits.too_many_requests(retry_after=3600)
     serializer = RegisterSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
         login(request, user)
-        return Response(UserSerializer(user).data, status=status.HTTP_201_CREATED)
+        return Response(user_with_tokens(user), status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
 @authentication_classes([])
+@ratelimit(key='ip', rate=ratelimits.login_rate, group='login', block=False)
 def login_view(request):
     username = request.data.get('username')
     password = request.data.get('password')
+    # Both checks are cache lookups, answered before the password hash runs
+    if getattr(request, 'limited', False):
+        return ratelimits.too_many_requests()
+    if any(value is not None and not isinstance(value, str) for value in (username, password)):
+        return Response({'error': 'username and password must be strings'}, status=status.HTTP_400_BAD_REQUEST)
+    if ratelimits.is_locked_out(username):
+        return ratelimits.too_many_requests(retry_after=settings.LOGIN_LOCKOUT_MINUTES * 60)
     user = authenticate(username=username, password=password)
     if user:
+        ratelimits.clear_failures(username)
         login(request, user)
-        return Response(UserSerializer(user).data)
+        return Response(user_with_tokens(user))
+    ratelimits.record_failure(username)
     return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
 @csrf_exempt
@@ -114,24 +337,162 @@ def current_user_view(request):
 @permission_classes([permissions.AllowAny])
 @authentication_classes([])
 def keep_alive(request):
+    # Served from the readiness monitor's last result instead of running a
+    # query per ping, so pingers never wait on a slow database.
+    monitor.start()
+    database = monitor.snapshot()['checks'].get('database')
     response_data = {'status': 'alive', 'database': 'unknown'}
+    if database is not None:
+        response_data['database'] = 'ok' if database['ok'] else 'unavailable'
+
+    return Response(response_data)
+
+# Liveness and readiness probes are plain Django views: they skip DRF's
+# request wrapping, authentication and content negotiation entirely.
+@csrf_exempt
+@require_GET
+def live(request):
+    return JsonResponse({'status': 'alive'})
+
+@csrf_exempt
+@require_GET
+def ready(request):
+    monitor.start()
+    snapshot = monitor.snapshot()
+    status_code = 200 if snapshot['status'] == 'ready' else 503
+    return JsonResponse(snapshot, status=status_code)
 
+@csrf_exempt
+@api_view(['GET', 'PUT'])
+@permission_classes([permissions.IsAdminUser])
+def video_upload_view(request, upload_id):
+    """
+    GET: how far a video upload has got. PUT: the next chunk as the raw
+    request body, with a Content-Range header.
+    """
     try:
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT 1;')
-            cursor.fetchone()
-        response_data['database'] = 'ok'
-    except DatabaseError:
-        # Keep the endpoint useful as an app liveness probe even if the DB is
-        # temporarily unavailable during cold starts or brief outages.
-        response_data['database'] = 'unavailable'
+        upload = VideoUpload.objects.get(pk=upload_id)
+    except VideoUpload.DoesNotExist:
+        raise Http404
+    if request.method == 'PUT':
+        try:
+            # the body is read straight from the request stream, never
+            # through request.data, so it is not held in memory
+            upload = uploads.append(upload, request.headers.get('Content-Range'), request.stream or io.BytesIO())
+        except uploads.OffsetMismatch as e:
+            return Response({'error': str(e), 'received': e.received}, status=status.HTTP_409_CONFLICT)
+        except uploads.ChunkTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(VideoUploadSerializer(upload).data)
 
-    return Response(response_data)
+@csrf_exempt
+@require_safe
+def media_file(request, path):
+    """
+    Uploaded media. Local files support Range requests (206) and carry a
+    content-hash ETag; with remote storage this redirects to the storage
+    URL, which handles ranges itself.
+    """
+    try:
+        full_path = default_storage.path(path)
+    except NotImplementedError:
+        response = HttpResponseRedirect(default_storage.url(path))
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+        return response
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    stat = os.stat(full_path)
+    etag = media.content_etag(full_path, stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        byte_range = None
+        if_range = request.headers.get('If-Range')
+        if not if_range or if_range == etag:
+            try:
+                byte_range = media.parse_range(request.headers.get('Range'), stat.st_size)
+            except media.Unsatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+
+        start, end = byte_range or (0, stat.st_size - 1)
+        response = FileResponse(
+            media.FileRange(open(full_path, 'rb'), start, end - start + 1),
+            status=206 if byte_range else 200,
+        )
+        response['Content-Length'] = end - start + 1
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['Last-Modified'] = http_date(stat.st_mtime)
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+@authentication_classes([])
+def cart_quote(request):
+    try:
+        quote = build_quote(request.data.get('items', []), request.data.get('currency'))
+    except QuoteError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(quote)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def sales_analytics(request):
+    params = request.query_params
+    end = parse_date(params.get('end', '')) if params.get('end') else timezone.localdate()
+    start = parse_date(params.get('start', '')) if params.get('start') else end - timedelta(days=30)
+    if start is None or end is None:
+        return Response({'error': 'start and end must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+    group_by = params.get('group_by') or None
+    if group_by and group_by not in rollups.GROUP_FIELDS:
+        return Response(
+            {'error': f"group_by must be one of {', '.join(rollups.GROUP_FIELDS)}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    statuses = params.get('status', '').split(',') if params.get('status') else rollups.REVENUE_STATUSES
+    product = params.get('product')
+    if product is not None and not product.isdigit():
+        return Response({'error': 'product must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = rollups.query(
+        start, end,
+        statuses=statuses,
+        currency=params.get('currency'),
+        product_id=int(product) if product is not None else None,
+        group_by=group_by,
+        limit=100 if group_by == 'product' else None,
+    )
+    return Response({
+        'start': start,
+        'end': end,
+        'statuses': statuses,
+        'group_by': group_by,
+        'rows': rows,
+    })
+
+@api_view(['GET'])
+@authentication_classes([MetricsTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+@permission_classes([CanReadMetrics])
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
 def create_checkout_session(request):
+    reservation = None
     try:
         data = request.data
         items = data.get('items', [])
@@ -143,61 +504,114 @@ def create_checkout_session(request):
         country = data.get('country', '')
         postal_code = data.get('postalCode', '')
         phone = data.get('phone', '')
-        shipping_cost = Decimal(str(data.get('shipping_cost') or 0))
-
-        # Create order in database first
-        total_amount = Decimal('0.00')
-        order = Order.objects.create(
-            first_name=first_name,
-            last_name=last_name,
-            email=email,
-            address=address,
-            city=city,
-            country=country,
-            postal_code=postal_code,
-            phone=phone,
-            total=0, # Will update after adding items
-            shipping=shipping_cost,
-            status='pending'
-        )
 
-        line_items = []
-        for item in items:
-            product_id = item.get('product', {}).get('id')
-            quantity = int(item.get('quantity') or 1)
-            unit_price = item.get('unit_price')
-            if unit_price is None:
-                return Response({'error': 'unit_price is required for each item'}, status=status.HTTP_400_BAD_REQUEST)
-            product = Product.objects.get(id=product_id)
-            
-            # Use frontend-provided price for this checkout
-            price = Decimal(str(unit_price))
-            total_amount += price * quantity
-            
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                name=product.name,
-                price=price,
-                quantity=quantity,
-                image_url=request.build_absolute_uri(product.image.url) if product.image else ''
+        if data.get('quote'):
+            # A signed quote from /api/cart/quote/ already holds the priced
+            # lines, shipping and total, so nothing is looked up or repriced.
+            try:
+                quote = load_quote(data['quote'])
+            except QuoteError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            currency = quote['currency'].lower()
+            shipping_cost = Decimal(quote['shipping'])
+            reservation = inventory.reserve(tracked_quantities(quote))
+            order = create_order_from_quote(
+                quote,
+                first_name=first_name,
+                last_name=last_name,
+                email=email,
+                address=address,
+                city=city,
+                country=country,
+                postal_code=postal_code,
+                phone=phone,
             )
-
-            line_items.append({
+            reservation.hold(order)
+            line_items = [{
                 'price_data': {
-                    'currency': 'usd',
+                    'currency': currency,
                     'product_data': {
-                        'name': product.name,
+                        'name': line['name'],
                     },
-                    'unit_amount': int(price * 100),
+                    'unit_amount': int(Decimal(line['unit_price']) * 100),
                 },
-                'quantity': quantity,
-            })
+                'quantity': line['quantity'],
+            } for line in quote['lines']]
+        else:
+            currency = 'usd'
+            shipping_cost = Decimal(str(data.get('shipping_cost') or 0))
+
+            total_amount = Decimal('0.00')
+
+            # One query for every product in the cart instead of one per line;
+            # keyed by str so ids sent as "5" or 5 both match
+            product_ids = [item.get('product', {}).get('id') for item in items]
+            products = {
+                str(pk): product
+                for pk, product in Product.objects.in_bulk([pk for pk in product_ids if pk is not None]).items()
+            }
+
+            line_items = []
+            order_items = []
+            for item in items:
+                product_id = item.get('product', {}).get('id')
+                quantity = int(item.get('quantity') or 1)
+                unit_price = item.get('unit_price')
+                if unit_price is None:
+                    return Response({'error': 'unit_price is required for each item'}, status=status.HTTP_400_BAD_REQUEST)
+                product = products.get(str(product_id))
+                if product is None:
+                    raise Product.DoesNotExist(f'Product with id {product_id} not found')
+
+                # Use frontend-provided price for this checkout
+                price = Decimal(str(unit_price))
+                total_amount += price * quantity
+
+                order_items.append(OrderItem(
+                    product=product,
+                    name=product.name,
+                    price=price,
+                    quantity=quantity,
+                    image_url=request.build_absolute_uri(product.image.url) if product.image else ''
+                ))
+
+                line_items.append({
+                    'price_data': {
+                        'currency': currency,
+                        'product_data': {
+                            'name': product.name,
+                        },
+                        'unit_amount': int(price * 100),
+                    },
+                    'quantity': quantity,
+                })
 
-        # Add shipping to total amount
-        total_amount += shipping_cost
-        order.total = total_amount
-        order.save()
+            # Hold stock for limited products before the order exists, so a
+            # sold-out checkout leaves nothing behind
+            reservation = inventory.reserve(
+                inventory.tracked_quantities((item.product, item.quantity) for item in order_items)
+            )
+
+            # Add shipping to total amount
+            total_amount += shipping_cost
+            order = Order.objects.create(
+                first_name=first_name,
+                last_name=last_name,
+                email=email,
+                address=address,
+                city=city,
+                country=country,
+                postal_code=postal_code,
+                phone=phone,
+                total=total_amount,
+                shipping=shipping_cost,
+                status='pending'
+            )
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.bulk_create(order_items)
+            rollups.record_order(order, order_items)
+            reservation.hold(order)
 
         # Send Confirmation Email
         send_order_confirmation_email(order)
@@ -206,7 +620,7 @@ def create_checkout_session(request):
         if shipping_cost > 0:
             line_items.append({
                 'price_data': {
-                    'currency': 'usd',
+                    'currency': currency,
                     'product_data': {
                         'name': 'Shipping Fee',
                     },
@@ -215,21 +629,28 @@ def create_checkout_session(request):
                 'quantity': 1,
             })
 
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=line_items,
-            mode='payment',
-            success_url=settings.FRONTEND_URL + '/order-confirmation?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=settings.FRONTEND_URL + '/checkout',
-            customer_email=email,
-            metadata={
-                'order_id': order.id
-            }
-        )
+        with track_external('stripe', 'checkout.Session.create'):
+            checkout_session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=line_items,
+                mode='payment',
+                success_url=settings.FRONTEND_URL + '/order-confirmation?session_id={CHECKOUT_SESSION_ID}',
+                cancel_url=settings.FRONTEND_URL + '/checkout',
+                customer_email=email,
+                metadata={
+                    'order_id': order.id
+                },
+                **reservation.session_params()
+            )
+        Order.objects.filter(pk=order.pk).update(stripe_session_id=checkout_session.id)
 
         return Response({'url': checkout_session.url})
+    except inventory.OutOfStock as e:
+        return Response({'error': str(e), 'available': e.available}, status=status.HTTP_409_CONFLICT)
     except Exception as e:
-        print(f"Error in create_checkout_session: {e}")
+        logger.exception('Error in create_checkout_session')
+        if reservation is not None:
+            reservation.cancel()
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @csrf_exempt
@@ -253,16 +674,22 @@ def stripe_webhook(request):
         session = event['data']['object']
         order_id = session.get('metadata', {}).get('order_id')
         if order_id:
-            try:
-                order = Order.objects.get(id=order_id)
-                # We no longer mark it as paid automatically.
-                # Admin will do it manually.
-                # order.status = 'paid'
-                # order.save()
-                # send_order_confirmation_email(order)
+            # We no longer mark it as paid automatically.
+            # Admin will do it manually.
+            # order.status = 'paid'
+            # order.save()
+            # send_order_confirmation_email(order)
+            # Only record the payment (a redelivered event keeps the first
+            # time), so expire_pending_orders leaves the order alone.
+            paid = Order.objects.filter(id=order_id).update(paid_at=Coalesce('paid_at', Value(timezone.now())))
+            if paid:
+                inventory.confirm(order_id)
                 print(f"Payment completed for order {order_id}. Awaiting admin verification.")
-            except Order.DoesNotExist:
-                pass
+    elif event['type'] == 'checkout.session.expired':
+        # The customer never paid: put any reserved stock back on the shelf
+        order_id = event['data']['object'].get('metadata', {}).get('order_id')
+        if order_id:
+            inventory.release(StockReservation.objects.filter(order_id=order_id))
 
     return Response(status=status.HTTP_200_OK)
 
@@ -270,3 +697,5 @@ RegisterView = register_view
 LoginView = login_view
 LogoutView = logout_view
 CurrentUserView = current_user_view
+SalesAnalyticsView = sales_analytics
+MetricsView = metrics_view
@@ -0,0 +1,68 @@
+import hmac
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT bearer authentication that keeps the token's user in the cache.
+
+    Checking a token is an HMAC, not a password hash, and with the user
+    cached an authenticated request needs no auth query at all. The cached
+    copy is dropped whenever the user is saved or deleted (api.signals).
+    That only reaches other workers through a shared cache, so users are
+    cached only with CACHE_URL set (AUTH_USER_CACHE_TIMEOUT); deactivating
+    someone or changing their staff flag then applies from their next
+    request.
+    """
+
+    def get_user(self, validated_token):
+        if not settings.AUTH_USER_CACHE_TIMEOUT:
+            return super().get_user(validated_token)
+        key = user_cache_key(validated_token.get(api_settings.USER_ID_CLAIM))
+        user = cache.get(key)
+        if user is None:
+            # raises AuthenticationFailed for unknown or inactive users,
+            # so only active users are ever cached
+            user = super().get_user(validated_token)
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Lets a metrics scraper in with `Authorization: Bearer <METRICS_TOKEN>`.
+    Any other credentials are left to the authentication classes after it.
+    """
+
+    def authenticate(self, request):
+        token = settings.METRICS_TOKEN
+        header = get_authorization_header(request).split()
+        if not token or len(header) != 2 or header[0].lower() != b'bearer':
+            return None
+        if not hmac.compare_digest(header[1], token.encode()):
+            return None
+        return AnonymousUser(), 'metrics'
+
+    def authenticate_header(self, request):
+        # answer failed scrapes with 401, like the JWT authentication
+        return 'Bearer realm="api"'
+
+
+class CanReadMetrics(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == 'metrics' or bool(request.user and request.user.is_staff)
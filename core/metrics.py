@@ -0,0 +1,172 @@
+"""
+Per-worker request metrics rendered in the Prometheus text format.
+
+Every gunicorn worker keeps its own registry in memory; each series carries
+a `worker` label so scrapes from different workers do not overwrite each
+other. Recording is a few dict updates under one lock, cheap enough to stay
+enabled in production.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from core import tracing
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency per view.', LATENCY_BUCKETS),
+    'http_requests_total': ('counter', 'Requests per view and status code.', None),
+    'db_queries_per_request': ('histogram', 'SQL queries issued per request.', QUERY_COUNT_BUCKETS),
+    'db_query_seconds_total': ('counter', 'Time spent in SQL per view.', None),
+    'external_call_duration_seconds': ('histogram', 'Calls to Stripe, SMTP and storage.', LATENCY_BUCKETS),
+}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {name: {} for name in METRICS}
+
+    def inc(self, name, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            state = series.get(key)
+            if state is None:
+                # one slot per bucket plus +Inf, then sum
+                state = series[key] = [0] * (len(buckets) + 1) + [0.0]
+            state[bisect_left(buckets, value)] += 1
+            state[-1] += value
+
+    def reset(self):
+        with self._lock:
+            self._series = {name: {} for name in METRICS}
+
+    def render(self):
+        with self._lock:
+            snapshot = {name: dict(series) for name, series in self._series.items()}
+
+        # Read the pid at render time: with `gunicorn --preload` the module is
+        # imported in the master before the workers fork.
+        worker = str(os.getpid())
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(snapshot[name].items()):
+                labels = dict(key, worker=worker)
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {value[-1]}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+registry = Registry()
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time', 'external')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.external = []
+
+
+_current = ContextVar('request_stats', default=None)
+
+
+def begin_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def count_query(execute, sql, params, many, context):
+    """Database execute_wrapper that adds each query to the current request."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+@contextmanager
+def track_external(service, operation=None):
+    """
+    Time a call to an external service (stripe, smtp, s3) and open a trace
+    span for it when the request is sampled.
+    """
+    started = time.perf_counter()
+    try:
+        with tracing.span(service, operation=operation):
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _current.get()
+        if stats is not None:
+            stats.external.append((service, elapsed))
+        else:
+            # Management commands and background threads have no request.
+            registry.observe('external_call_duration_seconds', {'view': 'none', 'service': service}, elapsed)
+
+
+def record_request(view, method, status_code, elapsed, stats):
+    labels = {'view': view, 'method': method}
+    registry.observe('http_request_duration_seconds', labels, elapsed)
+    registry.inc('http_requests_total', dict(labels, status=status_code))
+    registry.observe('db_queries_per_request', labels, stats.queries)
+    registry.inc('db_query_seconds_total', labels, stats.query_time)
+    for service, duration in stats.external:
+        registry.observe('external_call_duration_seconds', {'view': view, 'service': service}, duration)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    func = match.func
+    # DRF views (including @api_view functions) expose their class on `cls`;
+    # the function itself is just a generic `view` wrapper.
+    target = getattr(func, 'cls', func)
+    view = f'{target.__module__}.{target.__name__}'
+    # Router-generated viewset views carry their method -> action mapping.
+    actions = getattr(func, 'actions', None)
+    if actions:
+        action = actions.get(request.method.lower())
+        if action:
+            view = f'{view}.{action}'
+    return view
@@ -1,5 +1,14 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
 from django.views.decorators.csrf import csrf_exempt
 
+from core import metrics, routers, tracing
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
 class DisableCsrfForApiMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -8,3 +17,96 @@ class DisableCsrfForApiMiddleware:
         if request.path.startswith('/api/'):
             request._dont_enforce_csrf_checks = True
         return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL query count/time and external call time per view
+    into the in-process metrics registry (see core.metrics).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(metrics.count_query))
+                response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+
+        metrics.record_request(
+            metrics.view_label(request),
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+            stats,
+        )
+        return response
+
+
+class TracingMiddleware:
+    """
+    Builds a span tree for a sampled fraction of requests (TRACE_SAMPLE_RATE)
+    and hands it to the configured exporter (see core.tracing).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        root, token = tracing.start_trace('request', method=request.method, path=request.path)
+        if root is None:
+            return self.get_response(request)
+
+        status_code = 500
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(tracing.trace_query))
+                response = self.get_response(request)
+            status_code = response.status_code
+            return response
+        finally:
+            tracing.finish_trace(
+                root, token, view=metrics.view_label(request), status=status_code
+            )
+
+
+class ReplicaMiddleware:
+    """
+    Routes reads of safe requests to views marked `read_from_replica` to the
+    replica (see core.routers). A successful write sets a short-lived cookie
+    that keeps the client on the primary until the replica has caught up.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = routers.route_reads(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.reset_routing(token)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400 and routers.replica_configured():
+            response.set_cookie(
+                settings.READ_REPLICA_COOKIE,
+                '1',
+                max_age=settings.READ_REPLICA_STICKY_SECONDS,
+                secure=True,
+                httponly=True,
+                samesite='None',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if (
+            request.method in SAFE_METHODS
+            and getattr(view_class, 'read_from_replica', False)
+            and settings.READ_REPLICA_COOKIE not in request.COOKIES
+        ):
+            routers.route_reads(True)
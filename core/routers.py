@@ -0,0 +1,57 @@
+"""
+Read-replica routing.
+
+Writes always go to `default`. Reads go to the `replica` alias only while a
+request has opted in: ReplicaMiddleware does that for GET/HEAD/OPTIONS
+requests to views with `read_from_replica = True` (the catalog viewsets),
+unless the client wrote something within the last READ_REPLICA_STICKY_SECONDS
+and so must see its own changes. Everything else (checkout, webhooks, admin,
+management commands) reads from the primary. Without a `replica` database
+configured the router is a no-op.
+
+Catalog responses cached right after a change may be built from a replica
+that hasn't caught up yet; they are stale for at most the lag, until the
+next catalog change or the cache timeout.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def replica_requested():
+    return _use_replica.get()
+
+
+def route_reads(to_replica):
+    """Route reads in the current context; returns a token for reset_routing()."""
+    return _use_replica.set(to_replica)
+
+
+def reset_routing(token):
+    _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured():
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema from the primary
+        return db != REPLICA
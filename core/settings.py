@@ -1,8 +1,11 @@
 import os
+import tempfile
+from datetime import timedelta
 import certifi
 from pathlib import Path
 import environ
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Force SSL certificates to be found
 os.environ['SSL_CERT_FILE'] = certifi.where()
@@ -41,11 +44,14 @@ INSTALLED_APPS = [
     'rest_framework',
     'corsheaders',
     'storages',
+    'django_crontab',
     'api',
     'payments',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.TracingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'core.middleware.DisableCsrfForApiMiddleware',
@@ -54,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,6 +82,7 @@ CORS_ALLOW_HEADERS = [
     "accept",
     "accept-encoding",
     "authorization",
+    "content-range",
     "content-type",
     "dnt",
     "origin",
@@ -91,11 +99,41 @@ CSRF_TRUSTED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'core.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
 }
 
+# Basic auth runs the full password hash on every request; only turn it on
+# for clients that can't use tokens yet.
+ENABLE_BASIC_AUTH = env.bool('ENABLE_BASIC_AUTH', default=False)
+if ENABLE_BASIC_AUTH:
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'].append('rest_framework.authentication.BasicAuthentication')
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=env.int('JWT_ACCESS_MINUTES', default=60)),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=env.int('JWT_REFRESH_DAYS', default=7)),
+    'UPDATE_LAST_LOGIN': False,
+}
+
+# How long CachedJWTAuthentication keeps a token's user in the cache. Saving
+# a user drops their cached copy, but only in the process that saved them
+# unless the cache is shared, so without CACHE_URL users aren't cached (0).
+AUTH_USER_CACHE_TIMEOUT = env.int('AUTH_USER_CACHE_TIMEOUT', default=300 if env('CACHE_URL', default='') else 0)
+
+# Login/register throttling (see api.ratelimits). Counters live in CACHES,
+# so use a shared cache (CACHE_URL=redis://...) when running several
+# workers. Limits are per client address as read from X-Forwarded-For
+# behind TRUSTED_PROXY_COUNT reverse proxies (Koyeb's one by default), so
+# they don't all land on the proxy's address. Set TRUSTED_PROXY_COUNT=0
+# when clients connect directly, or X-Forwarded-For could be forged.
+LOGIN_RATE_LIMIT = env('LOGIN_RATE_LIMIT', default='10/m')
+REGISTER_RATE_LIMIT = env('REGISTER_RATE_LIMIT', default='5/h')
+LOGIN_LOCKOUT_ATTEMPTS = env.int('LOGIN_LOCKOUT_ATTEMPTS', default=5)
+LOGIN_LOCKOUT_MINUTES = env.int('LOGIN_LOCKOUT_MINUTES', default=15)
+TRUSTED_PROXY_COUNT = env.int('TRUSTED_PROXY_COUNT', default=1)
+RATELIMIT_IP_META_KEY = env('RATELIMIT_IP_META_KEY', default='api.ratelimits.forwarded_ip')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -118,10 +156,173 @@ WSGI_APPLICATION = 'core.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
-        conn_max_age=600
+        conn_max_age=env.int('DB_CONN_MAX_AGE', default=600),
+        conn_health_checks=env.bool('DB_CONN_HEALTH_CHECKS', default=True),
     )
 }
 
+# Read replica (see core.routers). With REPLICA_DATABASE_URL set, safe
+# requests to the catalog viewsets read from it; everything else uses
+# 'default'. A client that wrote something stays on the primary for
+# READ_REPLICA_STICKY_SECONDS, which should comfortably exceed the
+# replica's lag. In tests the replica mirrors 'default'.
+REPLICA_DATABASE_URL = env('REPLICA_DATABASE_URL', default='')
+if REPLICA_DATABASE_URL:
+    DATABASES['replica'] = dj_database_url.parse(
+        REPLICA_DATABASE_URL,
+        conn_max_age=DATABASES['default']['CONN_MAX_AGE'],
+        conn_health_checks=DATABASES['default']['CONN_HEALTH_CHECKS'],
+    )
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+# SQLite: the checkout, webhook and stock transactions read rows and then
+# write them. Under SQLite's default DEFERRED mode a transaction that tries
+# to upgrade its read lock while another connection writes fails at once
+# with "database is locked" (the busy timeout does not apply), so those
+# requests would error under any concurrency. IMMEDIATE makes each
+# transaction.atomic block take the write lock when it starts and wait up to
+# `timeout` seconds for it. Reads outside atomic blocks are not affected,
+# but atomic blocks do run one at a time; set SQLITE_TRANSACTION_MODE=DEFERRED
+# for a single-user dev server that would rather not wait.
+# Tests need a database file, not the in-memory one, for the stock
+# concurrency tests to race checkouts from separate connections; it is named
+# after the test process so parallel runs do not share it.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': env('SQLITE_TRANSACTION_MODE', default='IMMEDIATE'),
+        'timeout': 20,
+    })
+    DATABASES['default']['TEST'] = {
+        'NAME': os.path.join(tempfile.gettempdir(), f'skn_test_{os.getpid()}.sqlite3'),
+    }
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+READ_REPLICA_STICKY_SECONDS = env.int('READ_REPLICA_STICKY_SECONDS', default=10)
+READ_REPLICA_COOKIE = 'use_primary'
+
+# Connection pooling (PostgreSQL with psycopg 3 only). Without it every
+# gunicorn worker or thread keeps its own connection open; with DB_POOL=True
+# each process shares a psycopg_pool of DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE
+# connections (per database alias), so the total is bounded by
+# processes * DB_POOL_MAX_SIZE.
+# Requests wait up to DB_POOL_TIMEOUT seconds for a free connection before
+# failing. Idle connections above the minimum are closed after
+# DB_POOL_MAX_IDLE seconds, every connection is recycled after
+# DB_POOL_MAX_LIFETIME, and with DB_CONN_HEALTH_CHECKS each one is checked
+# before it is handed out. `manage.py bench` reports the pool's size, queued
+# requests, wait time and timeouts for each run, to size it under load.
+DB_POOL = env.bool('DB_POOL', default=False)
+for database in DATABASES.values():
+    if DB_POOL and database['ENGINE'] == 'django.db.backends.postgresql':
+        # The pool manages connection lifetime itself
+        database['CONN_MAX_AGE'] = 0
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+            'max_size': env.int('DB_POOL_MAX_SIZE', default=4),
+            'timeout': env.float('DB_POOL_TIMEOUT', default=10),
+            'max_idle': env.float('DB_POOL_MAX_IDLE', default=300),
+            'max_lifetime': env.float('DB_POOL_MAX_LIFETIME', default=1800),
+        }
+
+# Cache
+# Use CACHE_URL (e.g. redis://...) in production, fallback to local memory
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Sessions: 'db', 'cached_db' (read from the cache, written through to the
+# database) or 'cache' (cache only; sessions are lost when it is flushed).
+# The cache-backed stores need a shared CACHE_URL: with per-process local
+# memory a logout on one worker would leave the session alive on another,
+# so the default is 'db' until CACHE_URL is set.
+SESSION_STORE = env('SESSION_STORE', default='cached_db' if env('CACHE_URL', default='') else 'db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_STORE}'
+
+# Readiness checks (DB, cache, storage) run in the background this often
+HEALTH_CHECK_INTERVAL = env.int('HEALTH_CHECK_INTERVAL', default=15)
+
+# /api/metrics/ is for staff, or for a Prometheus scraper sending
+# `Authorization: Bearer <METRICS_TOKEN>` (bearer_token / authorization in
+# its scrape config). Unset, only staff can read it.
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Request tracing
+# Fraction of requests that get a span tree, and where finished traces go
+# ('stdout' or 'file', which appends JSON lines to TRACE_FILE)
+TRACE_SAMPLE_RATE = env.float('TRACE_SAMPLE_RATE', default=0.0)
+TRACE_EXPORTER = env('TRACE_EXPORTER', default='stdout')
+TRACE_FILE = env('TRACE_FILE', default=os.path.join(BASE_DIR, 'traces.jsonl'))
+
+# Error reporting (optional): only initialised when SENTRY_DSN is set
+SENTRY_DSN = env('SENTRY_DSN', default='')
+if SENTRY_DSN:
+    import sentry_sdk
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        traces_sample_rate=TRACE_SAMPLE_RATE,
+        send_default_pii=False,
+    )
+
+# Currency rates
+# Source for `manage.py refresh_currency_rates` (JSON with a "rates" object
+# relative to USD) and how often each process checks the table for new rates
+CURRENCY_RATES_URL = env('CURRENCY_RATES_URL', default='')
+CURRENCY_RATES_CHECK_INTERVAL = env.int('CURRENCY_RATES_CHECK_INTERVAL', default=30)
+
+# Signed cart quotes from /api/cart/quote/ are accepted at checkout for this long
+CART_QUOTE_MAX_AGE = env.int('CART_QUOTE_MAX_AGE', default=30 * 60)
+
+# Scheduled jobs (django-crontab: `manage.py crontab add`)
+CRONJOBS = [
+    ('0 */6 * * *', 'django.core.management.call_command', ['refresh_currency_rates']),
+    ('30 * * * *', 'django.core.management.call_command', ['update_bestsellers']),
+    ('*/15 * * * *', 'django.core.management.call_command', ['build_recommendations']),
+    # off the quarter hours, so it doesn't start alongside an incremental run
+    ('7 3 * * *', 'django.core.management.call_command', ['build_recommendations', '--full']),
+    ('*/5 * * * *', 'django.core.management.call_command', ['release_expired_reservations']),
+    ('15 * * * *', 'django.core.management.call_command', ['expire_pending_orders']),
+    ('0 4 * * *', 'django.core.management.call_command', ['archive_orders']),
+    ('30 4 * * *', 'django.core.management.call_command', ['clear_expired_sessions']),
+    ('*/15 * * * *', 'django.core.management.call_command', ['clear_stale_uploads']),
+    ('*/10 * * * *', 'django.core.management.call_command', ['publish_catalog']),
+]
+
+# Bestsellers: the BESTSELLER_COUNT products with the most units sold over
+# the last BESTSELLER_WINDOW_DAYS days (see api.bestsellers)
+BESTSELLER_WINDOW_DAYS = env.int('BESTSELLER_WINDOW_DAYS', default=30)
+BESTSELLER_COUNT = env.int('BESTSELLER_COUNT', default=12)
+
+# "Frequently bought together" products kept per product (see api.recommendations)
+RECOMMENDATION_COUNT = env.int('RECOMMENDATION_COUNT', default=8)
+
+# /api/products/{id}/bundle/: category siblings included, and how long a
+# bundle stays cached. Keys embed the catalog version, so with a shared
+# CACHE_URL edits show at once; with per-process local memory other
+# workers and the cron jobs can't bump it, so bundles only live a few
+# seconds.
+PRODUCT_BUNDLE_SIBLINGS = env.int('PRODUCT_BUNDLE_SIBLINGS', default=8)
+PRODUCT_BUNDLE_CACHE_TIMEOUT = env.int(
+    'PRODUCT_BUNDLE_CACHE_TIMEOUT', default=3600 if env('CACHE_URL', default='') else 5
+)
+
+# Stock reserved at checkout is held this long; Stripe sessions for orders
+# with reserved stock expire at the same time. Stripe refuses sessions that
+# expire less than 30 minutes after they are created, so this needs a
+# margin over that. Expired reservations are released after the grace
+# period, which leaves time for a late checkout.session.completed webhook.
+STOCK_RESERVATION_MINUTES = env.int('STOCK_RESERVATION_MINUTES', default=35)
+if STOCK_RESERVATION_MINUTES < 31:
+    raise ImproperlyConfigured('STOCK_RESERVATION_MINUTES must be at least 31 (Stripe sessions last 30 minutes or more)')
+STOCK_RESERVATION_GRACE_MINUTES = env.int('STOCK_RESERVATION_GRACE_MINUTES', default=5)
+
+# Pending orders older than this are abandoned checkouts and get cancelled
+PENDING_ORDER_TTL_HOURS = env.int('PENDING_ORDER_TTL_HOURS', default=48)
+
+# Delivered and cancelled orders older than this move to ArchivedOrder
+ORDER_ARCHIVE_AFTER_DAYS = env.int('ORDER_ARCHIVE_AFTER_DAYS', default=365)
+
+# Benchmark results written by `manage.py bench`
+BENCH_RESULTS_DIR = env('BENCH_RESULTS_DIR', default=os.path.join(BASE_DIR, 'bench_results'))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -161,6 +362,13 @@ SUPABASE_STORAGE_CONFIGURED = all([
     SUPABASE_S3_ENDPOINT_URL,
 ])
 
+# With Supabase storage, build media URLs from MEDIA_URL instead of
+# presigning them with boto3 (see core.storage.MediaStorage). The bucket is
+# public. Turning this off presigns every media URL in API responses, and
+# the static catalog (CATALOG_PUBLISH) refuses to publish, as its URLs would
+# expire.
+MEDIA_PUBLIC_URLS = env.bool('MEDIA_PUBLIC_URLS', default=True)
+
 if SUPABASE_STORAGE_CONFIGURED:
 
     # NEW: real S3 access keys from Supabase Storage → Settings → S3 access keys
@@ -185,6 +393,29 @@ else:
     MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
     MEDIA_URL = '/media/'
 
+# Browser/CDN cache lifetime for media. Uploads never overwrite an existing
+# name, so a URL's content only changes if a file is replaced by hand, and
+# the content-hash ETag catches that on revalidation.
+MEDIA_CACHE_MAX_AGE = env.int('MEDIA_CACHE_MAX_AGE', default=30 * 24 * 3600)
+
+# Resumable video uploads (see api.uploads). Part files are kept on the
+# instance's local disk, so with several instances route /api/uploads/ to
+# one of them or point UPLOAD_TEMP_DIR at a shared volume.
+UPLOAD_TEMP_DIR = env('UPLOAD_TEMP_DIR', default=os.path.join(tempfile.gettempdir(), 'skn-uploads'))
+UPLOAD_CHUNK_SIZE = env.int('UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024)
+VIDEO_UPLOAD_MAX_SIZE = env.int('VIDEO_UPLOAD_MAX_SIZE', default=1024 * 1024 * 1024)
+UPLOAD_EXPIRY_HOURS = env.int('UPLOAD_EXPIRY_HOURS', default=24)
+
+# Static catalog files for the storefront (see api.publisher), written to
+# the default storage under CATALOG_PUBLISH_PREFIX a short delay after
+# catalog changes. Off until the storefront reads the manifest. Publishes
+# are debounced through CACHES, so with per-process local memory each
+# worker schedules its own; all but the first find nothing to upload.
+CATALOG_PUBLISH = env.bool('CATALOG_PUBLISH', default=False)
+CATALOG_PUBLISH_DELAY = env.int('CATALOG_PUBLISH_DELAY', default=30)
+CATALOG_PUBLISH_KEEP = env.int('CATALOG_PUBLISH_KEEP', default=3)
+CATALOG_PUBLISH_PREFIX = 'catalog'
+
 
 
 # ===============================
@@ -193,7 +424,7 @@ else:
 STORAGES = {
     "default": {
         "BACKEND": (
-            "storages.backends.s3boto3.S3Boto3Storage"
+            "core.storage.MediaStorage"
             if SUPABASE_STORAGE_CONFIGURED
             else "django.core.files.storage.FileSystemStorage"
         ),
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.utils.encoding import filepath_to_uri
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+from core.metrics import track_external
+
+
+class MediaStorage(S3Boto3Storage):
+    """
+    Supabase S3 storage that reports the time spent talking to S3 to the
+    request metrics and traces.
+
+    The bucket is public, so with MEDIA_PUBLIC_URLS url() just appends the
+    name to MEDIA_URL. boto3 would otherwise build and sign an S3 URL for
+    every image of every product in a list response.
+    """
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if not settings.MEDIA_PUBLIC_URLS or parameters or expire is not None or http_method:
+            return super().url(name, parameters, expire, http_method)
+        return settings.MEDIA_URL + filepath_to_uri(self._normalize_name(clean_name(name)))
+
+    def get_object_parameters(self, name):
+        params = super().get_object_parameters(name)
+        # Published catalog files (api.publisher): the versioned ones never
+        # change, the manifest is replaced on every publish.
+        if name.endswith('.json.gz'):
+            params.update(
+                ContentType='application/json', ContentEncoding='gzip',
+                CacheControl='public, max-age=31536000, immutable',
+            )
+        elif name.endswith('/manifest.json'):
+            params['CacheControl'] = 'public, max-age=60'
+        return params
+
+    def _save(self, name, content):
+        with track_external('s3', 'put'):
+            return super()._save(name, content)
+
+    def _open(self, name, mode='rb'):
+        with track_external('s3', 'get'):
+            return super()._open(name, mode)
+
+    def delete(self, name):
+        with track_external('s3', 'delete'):
+            return super().delete(name)
+
+    def exists(self, name):
+        with track_external('s3', 'exists'):
+            return super().exists(name)
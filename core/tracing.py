@@ -0,0 +1,146 @@
+"""
+Lightweight per-request span trees exported as JSON lines.
+
+A sampled request gets a root span; SQL queries, Stripe, SMTP, S3 and PDF
+rendering add child spans underneath whatever span is active. Unsampled
+requests pay for one ContextVar lookup per instrumented call.
+
+Each exported trace also lists its critical path (the longest child at every
+level), which is what to look at first for a slow checkout.
+"""
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils import timezone
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children', 'count')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.count = 1
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self, origin):
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+        }
+        if self.count > 1:
+            data['count'] = self.count
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+_current_span = ContextVar('current_span', default=None)
+
+
+def start_trace(name, **attrs):
+    """Start a root span if this request is sampled; returns (span, token)."""
+    if random.random() >= settings.TRACE_SAMPLE_RATE:
+        return None, None
+    root = Span(name, attrs)
+    return root, _current_span.set(root)
+
+
+def finish_trace(root, token, **attrs):
+    _current_span.reset(token)
+    root.end = time.perf_counter()
+    root.attrs.update(attrs)
+    exporter.export({
+        'trace_id': uuid.uuid4().hex,
+        'timestamp': timezone.now().isoformat(),
+        'critical_path': critical_path(root),
+        'root': root.to_dict(root.start),
+    })
+
+
+@contextmanager
+def span(name, **attrs):
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def trace_query(execute, sql, params, many, context):
+    """
+    Database execute_wrapper. Consecutive runs of the same statement are
+    folded into one "db" span with a count, which makes N+1 loops stand out
+    as a single wide span instead of hundreds of tiny ones.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ended = time.perf_counter()
+        last = parent.children[-1] if parent.children else None
+        if last is not None and last.name == 'db' and last.attrs.get('sql') == sql:
+            last.count += 1
+            last.end = ended
+            last.attrs['db_ms'] = round(last.attrs['db_ms'] + (ended - started) * 1000, 3)
+        else:
+            group = Span('db', {'sql': sql, 'db_ms': round((ended - started) * 1000, 3)})
+            group.start = started
+            group.end = ended
+            parent.children.append(group)
+
+
+def critical_path(root):
+    path = []
+    node = root
+    while node is not None:
+        path.append({'name': node.name, 'duration_ms': round(node.duration * 1000, 3)})
+        node = max(node.children, key=lambda child: child.duration, default=None)
+    return path
+
+
+class Exporter:
+    """Writes finished traces as JSON lines to stdout or to TRACE_FILE."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        line = json.dumps(trace, default=str) + '\n'
+        with self._lock:
+            if settings.TRACE_EXPORTER == 'file':
+                with open(settings.TRACE_FILE, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            else:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+
+exporter = Exporter()
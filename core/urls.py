@@ -16,14 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
+from api.views import live, media_file, ready
 
 urlpatterns = [
     path('admin/', admin.site.urls), # This is the django admin
+    path('live/', live, name='live'),
+    path('ready/', ready, name='ready'),
     path('api/', include('api.urls')),
      path('api/payments/', include('payments.urls')),
+    path('media/<path:path>', media_file, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,3 +1,78 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, TestCase
+from rest_framework.test import APIClient
+
+from api import currency, lifecycle
+from api.benchmark import FakeCheckoutSession
+from api.models import ArchivedOrder, Order
+from api.tests import QueryBudgetMixin, checkout_payload, make_order, make_products
+
+from .views import create_checkout_session
+
+
+@mock.patch('stripe.checkout.Session.create', side_effect=FakeCheckoutSession.create)
+class CheckoutQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    payments.views.create_checkout_session is shadowed by the api app's view
+    at /api/payments/create-checkout-session/, so it is called directly.
+    """
+
+    def setUp(self):
+        currency.get_rates()  # rates are loaded once per process, not per checkout
+
+    def checkout(self, products, **extra):
+        request = RequestFactory().post(
+            '/api/payments/create-checkout-session/',
+            checkout_payload(products, **extra),
+            content_type='application/json',
+        )
+        return create_checkout_session(request)
+
+    def test_checkout_queries(self, create_session):
+        self.assertQueryBudget(
+            6, lambda size: make_products(size, images=0), lambda products: self.checkout(products, currency='GBP')
+        )
+
+    def test_checkout_time_budget(self, create_session):
+        products = make_products(20, images=0)
+        response = self.assertWithinBudget(0.5, lambda: self.checkout(products, currency='GBP'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('url', json.loads(response.content))
+        order = Order.objects.get()
+        self.assertEqual(order.currency, 'GBP')
+        self.assertEqual(create_session.call_args.kwargs['metadata'], {'order_id': order.pk})
+        self.assertTrue(order.stripe_session_id.startswith('cs_bench_'))
+
+
+class ReceiptQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        currency.get_rates()
+
+    def test_receipt_queries(self):
+        self.assertQueryBudget(
+            2,
+            lambda size: make_order(make_products(size, images=0)),
+            lambda order: self.client.get(f'/api/payments/generate-receipt/{order.pk}/'),
+        )
+
+    def test_receipt_time_budget(self):
+        order = make_order(make_products(50, images=0))
+        response = self.assertWithinBudget(
+            1.0, lambda: self.client.get(f'/api/payments/generate-receipt/{order.pk}/')
+        )
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_receipt_for_archived_order(self):
+        order = make_order(make_products(3, images=0), status='delivered')
+        Order.objects.filter(pk=order.pk).update(created_at=order.created_at.replace(year=2020))
+        lifecycle.archive(log=lambda message: None)
+        self.assertTrue(ArchivedOrder.objects.filter(pk=order.pk).exists())
+
+        response = self.client.get(f'/api/payments/generate-receipt/{order.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        self.assertEqual(self.client.get('/api/payments/generate-receipt/999999/').status_code, 404)
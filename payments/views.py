@@ -1,12 +1,19 @@
 import json
+import logging
 import stripe
 import os
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.shortcuts import get_object_or_404
 from api.models import Product, Order, OrderItem
+from api.currency import convert, get_rate, get_symbol
 from api.emails import send_order_confirmation_email
+from api.lifecycle import get_order
+from api import inventory
+from api.pricing import QuoteError, create_order_from_quote, load_quote, tracked_quantities
+from api.rollups import record_order
+from core.metrics import track_external
+from core.tracing import span
 from decimal import Decimal
 from io import BytesIO
 from reportlab.lib import colors
@@ -17,47 +24,17 @@ from reportlab.lib.units import inch
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
-# =========================
-# CURRENCY CONFIG
-# =========================
-CURRENCY_RATES = {
-    "USD": Decimal("1"),
-    "GBP": Decimal("0.79"),
-    "AED": Decimal("3.67"),
-    "AUD": Decimal("1.52"),
-}
-
-CURRENCY_SYMBOLS = {
-    "USD": "$",
-    "GBP": "£",
-    "AED": "د.إ",
-    "AUD": "A$",
-}
+logger = logging.getLogger(__name__)
 
 @csrf_exempt
 def create_checkout_session(request):
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request"}, status=400)
 
+    reservation = None
     try:
         data = json.loads(request.body.decode("utf-8"))
 
-        items_data = data.get("items", [])
-        if not items_data:
-            return JsonResponse({"error": "Items are required"}, status=400)
-
-        # =========================
-        # READ CURRENCY
-        # =========================
-        currency = data.get("currency", "USD")
-        if currency not in CURRENCY_RATES:
-            return JsonResponse({"error": "Invalid currency"}, status=400)
-
-        rate = CURRENCY_RATES[currency]
-
-        # shipping comes in "base" currency (USD in your frontend), then converted
-        shipping_cost = Decimal(str(data.get("shipping_cost") or 0)) * rate
-
         email = data.get("email")
         first_name = data.get("firstName")
         last_name = data.get("lastName")
@@ -67,83 +44,130 @@ def create_checkout_session(request):
         postal_code = data.get("postalCode")
         phone = data.get("phone", "")
 
-        subtotal = Decimal("0.00")
-        order_items_to_create = []
+        customer = {
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": email,
+            "address": address,
+            "city": city,
+            "country": country,
+            "postal_code": postal_code,
+            "phone": phone,
+        }
 
         # =========================
-        # USE PRICE FROM CHECKOUT (unit_price)
+        # SIGNED QUOTE (from /api/cart/quote/)
         # =========================
-        for item in items_data:
-            product_id = item.get("product", {}).get("id")
-            quantity = int(item.get("quantity") or 1)
-
-            # this MUST be sent from the frontend
-            unit_price = item.get("unit_price")
-            if unit_price is None:
-                return JsonResponse(
-                    {"error": "unit_price is required for each item"},
-                    status=400,
-                )
-
+        if data.get("quote"):
+            # prices, shipping and total were fixed when the quote was signed
             try:
-                product = Product.objects.get(id=product_id)
-            except Product.DoesNotExist:
-                return JsonResponse(
-                    {"error": f"Product with id {product_id} not found"},
-                    status=404,
+                quote = load_quote(data["quote"])
+            except QuoteError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            reservation = inventory.reserve(tracked_quantities(quote))
+            order = create_order_from_quote(quote, **customer)
+            reservation.hold(order)
+            currency = order.currency
+            total = order.total
+        else:
+            items_data = data.get("items", [])
+            if not items_data:
+                return JsonResponse({"error": "Items are required"}, status=400)
+
+            # =========================
+            # READ CURRENCY
+            # =========================
+            # rates come from the cached CurrencyRate table (see api.currency)
+            currency = data.get("currency", "USD")
+            rate = get_rate(currency)
+            if rate is None:
+                return JsonResponse({"error": "Invalid currency"}, status=400)
+
+            # shipping comes in "base" currency (USD in your frontend), then converted
+            shipping_cost = convert(Decimal(str(data.get("shipping_cost") or 0)), rate)
+
+            subtotal = Decimal("0.00")
+            order_items_to_create = []
+
+            # one query for the whole cart; keyed by str so "5" and 5 both match
+            product_ids = [item.get("product", {}).get("id") for item in items_data]
+            products = {
+                str(pk): product
+                for pk, product in Product.objects.in_bulk(
+                    [pk for pk in product_ids if pk is not None]
+                ).items()
+            }
+
+            # =========================
+            # USE PRICE FROM CHECKOUT (unit_price)
+            # =========================
+            for item in items_data:
+                product_id = item.get("product", {}).get("id")
+                quantity = int(item.get("quantity") or 1)
+
+                # this MUST be sent from the frontend
+                unit_price = item.get("unit_price")
+                if unit_price is None:
+                    return JsonResponse(
+                        {"error": "unit_price is required for each item"},
+                        status=400,
+                    )
+
+                product = products.get(str(product_id))
+                if product is None:
+                    return JsonResponse(
+                        {"error": f"Product with id {product_id} not found"},
+                        status=404,
+                    )
+
+                # price coming from frontend (base currency, e.g. USD)
+                frontend_price = Decimal(str(unit_price))
+
+                # convert to selected currency
+                converted_price = convert(frontend_price, rate)
+
+                item_total = converted_price * Decimal(str(quantity))
+                subtotal += item_total
+
+                order_items_to_create.append(
+                    {
+                        "product": product,
+                        "name": product.name,
+                        "price": converted_price,  # stored in chosen currency
+                        "quantity": quantity,
+                        "image_url": product.image.url if product.image else "",
+                    }
                 )
 
-            # price coming from frontend (base currency, e.g. USD)
-            frontend_price = Decimal(str(unit_price))
-
-            # convert to selected currency
-            converted_price = frontend_price * rate
-
-            item_total = converted_price * Decimal(str(quantity))
-            subtotal += item_total
-
-            order_items_to_create.append(
-                {
-                    "product": product,
-                    "name": product.name,
-                    "price": converted_price,  # stored in chosen currency
-                    "quantity": quantity,
-                    "image_url": product.image.url if product.image else "",
-                }
+            total = subtotal + shipping_cost
+
+            # =========================
+            # RESERVE STOCK
+            # =========================
+            # limited products are taken off the shelf before the order exists
+            reservation = inventory.reserve(inventory.tracked_quantities(
+                (item["product"], item["quantity"]) for item in order_items_to_create
+            ))
+
+            # =========================
+            # CREATE ORDER
+            # =========================
+            order = Order.objects.create(
+                **customer,
+                total=total,
+                shipping=shipping_cost,
+                currency=currency,
+                status="pending",
             )
 
-        total = subtotal + shipping_cost
-
-        # =========================
-        # CREATE ORDER
-        # =========================
-        order = Order.objects.create(
-            first_name=first_name,
-            last_name=last_name,
-            email=email,
-            address=address,
-            city=city,
-            country=country,
-            postal_code=postal_code,
-            phone=phone,
-            total=total,
-            shipping=shipping_cost,
-            currency=currency,
-            status="pending",
-        )
-
-        # =========================
-        # CREATE ORDER ITEMS
-        # =========================
-        for item_data in order_items_to_create:
-            OrderItem.objects.create(
-                order=order,
-                product=item_data["product"],
-                name=item_data["name"],
-                price=item_data["price"],
-                quantity=item_data["quantity"],
-                image_url=item_data["image_url"],
+            # =========================
+            # CREATE ORDER ITEMS
+            # =========================
+            order_items = OrderItem.objects.bulk_create(
+                [OrderItem(order=order, **item_data) for item_data in order_items_to_create]
             )
+            record_order(order, order_items)
+            reservation.hold(order)
 
         # =========================
         # SEND EMAIL
@@ -155,39 +179,52 @@ def create_checkout_session(request):
         # =========================
         stripe_amount = int(total * 100)  # Stripe wants smallest currency unit
 
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="payment",
-            customer_email=email,
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": currency.lower(),
-                        "product_data": {
-                            "name": "SKN Hair Care Order",
-                            "description": f"Order #{order.id}",
+        with track_external("stripe", "checkout.Session.create"):
+            checkout_session = stripe.checkout.Session.create(
+                payment_method_types=["card"],
+                mode="payment",
+                customer_email=email,
+                line_items=[
+                    {
+                        "price_data": {
+                            "currency": currency.lower(),
+                            "product_data": {
+                                "name": "SKN Hair Care Order",
+                                "description": f"Order #{order.id}",
+                            },
+                            "unit_amount": stripe_amount,
                         },
-                        "unit_amount": stripe_amount,
-                    },
-                    "quantity": 1,
-                }
-            ],
-            success_url=settings.FRONTEND_URL
-            + "/order-confirmation?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url=settings.FRONTEND_URL + "/checkout",
-        )
+                        "quantity": 1,
+                    }
+                ],
+                success_url=settings.FRONTEND_URL
+                + "/order-confirmation?session_id={CHECKOUT_SESSION_ID}",
+                cancel_url=settings.FRONTEND_URL + "/checkout",
+                metadata={"order_id": order.id},
+                **reservation.session_params(),
+            )
+        Order.objects.filter(pk=order.pk).update(stripe_session_id=checkout_session.id)
 
         return JsonResponse({"url": checkout_session.url})
 
+    except inventory.OutOfStock as e:
+        return JsonResponse({"error": str(e), "available": e.available}, status=409)
+
     except Exception as e:
+        logger.exception("Error in create_checkout_session")
+        if reservation is not None:
+            reservation.cancel()
         return JsonResponse({"error": str(e)}, status=400)
 
 # =========================
 # RECEIPT PDF
 # =========================
 def generate_receipt_pdf(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    symbol = CURRENCY_SYMBOLS.get(order.currency, "$")
+    # reads through to archived orders (see api.lifecycle)
+    order = get_order(order_id)
+    if order is None:
+        raise Http404("Order not found")
+    symbol = get_symbol(order.currency)
 
     response = HttpResponse(content_type="application/pdf")
     response["Content-Disposition"] = f'attachment; filename="receipt_{order.id}.pdf"'
@@ -266,7 +303,8 @@ def generate_receipt_pdf(request, order_id):
 
     elements.append(Table(totals_data, colWidths=[0.6 * inch, 3.4 * inch, 1.25 * inch, 1.25 * inch]))
 
-    doc.build(elements)
+    with span("reportlab.build", order_id=order.id):
+        doc.build(elements)
     pdf = buffer.getvalue()
     buffer.close()
     response.write(pdf)